@@ -1,7 +1,68 @@
+from django import forms
 from django.contrib import admin
 
 from .models import *
 
-admin.site.register(Wallet)
+admin.site.register(PendingCredit)
 admin.site.register(Item)
-admin.site.register(InventoryItem)
+
+
+class InventoryItemForm(forms.ModelForm):
+    def clean_count(self):
+        count = self.cleaned_data['count']
+        if not self.instance.pk and count <= 0:
+            raise forms.ValidationError('Granted count must be positive')
+        return count
+
+    def validate_unique(self):
+        # Granting an item the user already holds adds to their stack instead of failing on unique-user-item
+        if self.instance.pk:
+            super().validate_unique()
+
+
+@admin.register(InventoryItem)
+class InventoryItemAdmin(admin.ModelAdmin):
+    form = InventoryItemForm
+    list_display = ['user', 'item', 'count']
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            return super().save_model(request, obj, form, change)
+        InventoryItem.add_many({(obj.user_id, obj.item_id): obj.count})
+        obj.pk = InventoryItem.objects.get(user_id=obj.user_id, item_id=obj.item_id).pk
+
+
+# The trade ledger is append-only and candles are rolled up from it, so staff can look but not touch
+class ReadOnlyAdmin(admin.ModelAdmin):
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Trade)
+class TradeAdmin(ReadOnlyAdmin):
+    list_display = ['item', 'sequence', 'price', 'count', 'buyer', 'seller', 'timestamp']
+
+
+@admin.register(Candle)
+class CandleAdmin(ReadOnlyAdmin):
+    list_display = ['item', 'interval', 'start', 'open', 'high', 'low', 'close', 'volume']
+
+
+# Striping only changes through Wallet.set_stripes, which moves the coins along with it
+@admin.register(Wallet)
+class WalletAdmin(admin.ModelAdmin):
+    readonly_fields = ['stripes']
+
+
+@admin.register(WalletStripe)
+class WalletStripeAdmin(ReadOnlyAdmin):
+    list_display = ['wallet', 'index', 'coins']
+
+
+admin.site.register(Order)
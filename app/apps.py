@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class AppConfig(AppConfig):
     name = 'app'
+
+    def ready(self):
+        from app.middleware import install_request_wrappers
+        connection_created.connect(install_request_wrappers)
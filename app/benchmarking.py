@@ -0,0 +1,107 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def histogram(latencies, bounds):
+    counts = [0] * (len(bounds) + 1)
+    for latency in latencies:
+        counts[next((index for index, bound in enumerate(bounds) if latency < bound), len(bounds))] += 1
+    return counts
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else 0.0,
+    }
+
+
+async def asgi_request(application, method, path, headers=(), body=b''):
+    url = urlsplit(path)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': url.path,
+        'raw_path': url.path.encode(),
+        'query_string': url.query.encode(),
+        'headers': [(b'host', b'localhost'), *((name.lower().encode(), value.encode()) for name, value in headers)],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    request_sent = False
+    response = {'status': None, 'body': b''}
+
+    async def receive():
+        nonlocal request_sent
+        if request_sent:
+            return {'type': 'http.disconnect'}
+        request_sent = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+
+    await application(scope, receive, send)
+    return response['status'], response['body']
+
+
+async def run_concurrently(count, concurrency, make_request):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = []
+
+    async def run_one(index):
+        async with semaphore:
+            start = time.perf_counter()
+            status, _ = await make_request(index)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(status)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_one(index) for index in range(count)))
+    return time.perf_counter() - start, latencies, statuses
+
+
+def load_traffic(path):
+    with open(path) as traffic:
+        return [json.loads(line) for line in traffic if line.strip()]
+
+
+async def replay_traffic(application, records, concurrency, speed):
+    # With a speed the records are sent on their recorded schedule compressed by it, without one as fast as the
+    # concurrency allows
+    semaphore = asyncio.Semaphore(concurrency)
+    first_time = records[0]['time'] if records else 0
+    start = time.perf_counter()
+
+    async def replay_one(record):
+        if speed:
+            await asyncio.sleep(max(0.0, (record['time'] - first_time) / speed - (time.perf_counter() - start)))
+        headers = [(name, record[key]) for name, key in [('Authorization', 'authorization'),
+                                                         ('Content-Type', 'content_type')] if record.get(key)]
+        async with semaphore:
+            request_start = time.perf_counter()
+            status, _ = await asgi_request(application, record['method'], record['path'], headers,
+                                           record.get('body', '').encode())
+            return record, status, time.perf_counter() - request_start
+
+    results = await asyncio.gather(*(replay_one(record) for record in records))
+    return time.perf_counter() - start, results
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.cache import caches
+
+BOOK_CACHE_ALIAS = getattr(settings, 'BOOK_CACHE_ALIAS', 'order-books')
+
+
+def get_book_snapshot(item, name, build):
+    # Every write to the book bumps Item.book_version, so a cached snapshot is never served once it is stale
+    cache = caches[BOOK_CACHE_ALIAS]
+    key = f'book:{item.pk}:{item.book_version}:{name}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build()
+        cache.set(key, snapshot)
+    return snapshot
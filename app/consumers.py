@@ -0,0 +1,87 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from app.market_data import book_group_name
+from app.models import Item, Listing
+
+
+def load_book(item_id):
+    while True:
+        version = Item.objects.filter(pk=item_id).values_list('book_version', flat=True).first()
+        if version is None:
+            return None
+        buy_levels = list(Listing.objects.buy_side(item_id).levels())
+        sell_levels = list(Listing.objects.sell_side(item_id).levels())
+        # A write committed between the reads would make the levels newer than the version they are sent with
+        if version == Item.objects.filter(pk=item_id).values_list('book_version', flat=True).first():
+            return {'version': version, 'buy': buy_levels, 'sell': sell_levels}
+
+
+class BookConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        self.item_id = self.scope['url_route']['kwargs']['pk']
+        self.sequence = 0
+        self.version = None
+        self.levels = {}
+        # Join the group before reading the snapshot, so no change committed after the read can be missed
+        await self.channel_layer.group_add(book_group_name(self.item_id), self.channel_name)
+        await self.accept()
+        await self.send_snapshot()
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(book_group_name(self.item_id), self.channel_name)
+
+    async def send_snapshot(self):
+        book = await database_sync_to_async(load_book)(self.item_id)
+        if book is None:
+            await self.close(code=4404)
+            return
+        self.version = book['version']
+        self.levels = {
+            side: {level['price']: [level['total_count'], level['order_count']] for level in book[side]}
+            for side in ['buy', 'sell']
+        }
+        await self.send_message({
+            'type': 'snapshot',
+            'version': self.version,
+            'buyLevels': book['buy'],
+            'sellLevels': book['sell'],
+        })
+
+    async def book_changes(self, event):
+        if self.version is None or event['version'] <= self.version:
+            return
+        if event['version'] != self.version + 1:
+            # A change was missed, e.g. it was published by another process, so start over from a fresh snapshot
+            await self.send_snapshot()
+            return
+        self.version = event['version']
+        for side, price, count, orders in event['levels']:
+            await self.send_level_change(side, price, count, orders)
+        for trade in event['trades']:
+            await self.send_message({'type': 'trade', 'version': self.version, **trade})
+
+    async def send_level_change(self, side, price, count, orders):
+        if not count and not orders:
+            return
+        levels = self.levels[side]
+        action = 'changed' if price in levels else 'added'
+        level = levels.setdefault(price, [0, 0])
+        level[0] += count
+        level[1] += orders
+        if level[1] <= 0:
+            del levels[price]
+            action = 'removed'
+        await self.send_message({
+            'type': 'level',
+            'action': action,
+            'version': self.version,
+            'side': side,
+            'price': price,
+            'total_count': max(level[0], 0),
+            'order_count': max(level[1], 0),
+        })
+
+    async def send_message(self, message):
+        self.sequence += 1
+        await self.send_json({'seq': self.sequence, **message})
@@ -16,3 +16,11 @@ class CannotAffordError(Exception):
 
 class InvalidTransactionError(Exception):
     ...
+
+
+class StripingChangedError(Exception):
+    ...
+
+
+class MissingWalletStripesError(Exception):
+    ...
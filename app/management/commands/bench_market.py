@@ -0,0 +1,157 @@
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from app.benchmarking import summarize
+from app.errors import FailedToCreateListingError, FailedToMakeTransactionError
+from app.metrics import QueryStats
+from app.models import InventoryItem, Item, Listing, Wallet
+
+OPERATIONS = ['buy', 'buy_listing', 'sell_listing', 'cancel']
+
+
+class Command(BaseCommand):
+    help = 'Seeds a synthetic market and drives the order entry model methods from a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--items', type=int, default=10)
+        parser.add_argument('--listings', type=int, default=1000, help='Listings seeded across all items')
+        parser.add_argument('--operations', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--distribution', choices=['uniform', 'normal', 'lognormal'], default='normal',
+                            help='Distribution listing and order prices are drawn from')
+        parser.add_argument('--price', type=int, default=100, help='Mean price')
+        parser.add_argument('--spread', type=int, default=20, help='Width of the price distribution')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the market and the operation sequence')
+        parser.add_argument('--prefix', default='bench-market', help='Prefix of the seeded users and items, '
+                                                                     'anything already using it is deleted first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users, items = self.seed(rng, options)
+        plan = [self.plan_operation(rng, users, items, options) for _ in range(options['operations'])]
+
+        results = defaultdict(list)
+        operations = queue.Queue()
+        for operation in plan:
+            operations.put(operation)
+        workers = [threading.Thread(target=self.work, args=(operations, results))
+                   for _ in range(options['workers'])]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        self.report(results, elapsed)
+
+    def seed(self, rng, options):
+        prefix = options['prefix']
+        User.objects.filter(username__startswith=prefix).delete()
+        Item.objects.filter(name__startswith=prefix).delete()
+
+        User.objects.bulk_create(User(username=f'{prefix}-{i}') for i in range(options['users']))
+        users = list(User.objects.filter(username__startswith=prefix).order_by('pk'))
+        Wallet.objects.bulk_create(Wallet(user=user, coins=10 ** 9) for user in users)
+        Item.objects.bulk_create(Item(name=f'{prefix}-{i}') for i in range(options['items']))
+        items = list(Item.objects.filter(name__startswith=prefix).order_by('pk'))
+        InventoryItem.objects.bulk_create(InventoryItem(user=user, item=item, count=10 ** 6)
+                                          for user in users for item in items)
+
+        listings = []
+        for _ in range(options['listings']):
+            direction = rng.choice([Listing.Direction.BUY, Listing.Direction.SELL])
+            # Buys rest below the mean and sells above it, so the seeded books do not cross
+            offset = abs(self.price(rng, options) - options['price']) + 1
+            price = options['price'] - offset if direction == Listing.Direction.BUY else options['price'] + offset
+            listings.append(Listing(item=rng.choice(items), submitter=rng.choice(users), direction=direction,
+                                    count=rng.randint(1, 10), price=max(1, price)))
+        Listing.objects.bulk_create(listings)
+        return users, items
+
+    def price(self, rng, options):
+        mean, spread = options['price'], options['spread']
+        if options['distribution'] == 'uniform':
+            price = rng.uniform(mean - spread, mean + spread)
+        elif options['distribution'] == 'normal':
+            price = rng.gauss(mean, spread / 2)
+        else:
+            price = mean * rng.lognormvariate(0, spread / mean)
+        return max(1, round(price))
+
+    def plan_operation(self, rng, users, items, options):
+        return {
+            'name': rng.choice(OPERATIONS),
+            'user': rng.choice(users),
+            'item': rng.choice(items),
+            'count': rng.randint(1, 10),
+            'price': self.price(rng, options),
+        }
+
+    def work(self, operations, results):
+        try:
+            while True:
+                try:
+                    operation = operations.get_nowait()
+                except queue.Empty:
+                    return
+                results[operation['name']].append(self.run_operation(operation))
+        finally:
+            connection.close()
+
+    def run_operation(self, operation):
+        user, item = operation['user'], operation['item']
+        if operation['name'] == 'sell_listing':
+            target = InventoryItem.objects.get(user=user, item=item)
+        elif operation['name'] == 'cancel':
+            target = Listing.objects.filter(submitter=user, item=item).order_by('pk').first()
+            if target is None:
+                return None
+        else:
+            target = item
+
+        stats = QueryStats()
+        error = None
+        start = time.perf_counter()
+        with connection.execute_wrapper(stats):
+            try:
+                if operation['name'] == 'buy':
+                    target.make_buy_transaction(user, operation['count'])
+                elif operation['name'] == 'buy_listing':
+                    target.make_buy_listing(user, operation['count'], operation['price'])
+                elif operation['name'] == 'sell_listing':
+                    target.make_sell_listing(operation['count'], operation['price'])
+                else:
+                    target.cancel()
+            except (FailedToCreateListingError, FailedToMakeTransactionError):
+                error = 'rejected'
+            except DatabaseError:
+                # On SQLite concurrent writers fail with "database is locked" rather than waiting on row locks
+                error = 'database'
+        return time.perf_counter() - start, stats.queries, stats.lock_wait, error
+
+    def report(self, results, elapsed):
+        total = sum(1 for samples in results.values() for sample in samples if sample is not None)
+        self.stdout.write(f'{total} operations in {elapsed:.2f}s, {total / elapsed:.1f} ops/s')
+        self.stdout.write(f'{"operation":<14}{"count":>7}{"rejected":>10}{"db errors":>11}{"p50 ms":>10}'
+                          f'{"p95 ms":>10}{"p99 ms":>10}{"queries":>9}{"lock ms":>10}')
+        for name in OPERATIONS:
+            samples = [sample for sample in results[name] if sample is not None]
+            if not samples:
+                continue
+            stats = summarize([latency for latency, _, _, _ in samples])
+            queries = sum(queries for _, queries, _, _ in samples) / len(samples)
+            lock_wait = sum(lock_wait for _, _, lock_wait, _ in samples) / len(samples)
+            rejected = sum(1 for _, _, _, error in samples if error == 'rejected')
+            database_errors = sum(1 for _, _, _, error in samples if error == 'database')
+            self.stdout.write(f'{name:<14}{len(samples):>7}{rejected:>10}{database_errors:>11}'
+                              f'{stats["p50"] * 1000:>10.2f}{stats["p95"] * 1000:>10.2f}{stats["p99"] * 1000:>10.2f}'
+                              f'{queries:>9.1f}{lock_wait * 1000:>10.3f}')
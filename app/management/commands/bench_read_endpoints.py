@@ -0,0 +1,45 @@
+import asyncio
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from app.benchmarking import asgi_request, run_concurrently, summarize
+from app.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Compares the throughput of the sync and async read endpoints, calling the ASGI application in-process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--item', type=int, help='Item whose book is read, defaults to the first item')
+        parser.add_argument('--username', default='bench', help='User whose dashboard and inventory are read')
+
+    def handle(self, *args, **options):
+        from auction_house.asgi import application
+
+        item = Item.objects.filter(pk=options['item']).first() if options['item'] else Item.objects.first()
+        if item is None:
+            raise CommandError('No item to read the book of')
+        user, _ = User.objects.get_or_create(username=options['username'])
+        token, _ = Token.objects.get_or_create(user=user)
+        headers = [('Authorization', f'Token {token.key}')]
+
+        endpoints = [
+            ('item_listings', f'/api/v1/item/{item.pk}/listings', f'/api/v1/async/item/{item.pk}/listings'),
+            ('dashboard', '/api/v1/dashboard', '/api/v1/async/dashboard'),
+            ('items', '/api/v1/items/', '/api/v1/async/items/'),
+            ('inventory', '/api/v1/inventory/', '/api/v1/async/inventory/'),
+        ]
+        self.stdout.write(f'{"endpoint":<16}{"path":<7}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        for name, sync_path, async_path in endpoints:
+            for kind, path in [('sync', sync_path), ('async', async_path)]:
+                elapsed, latencies, statuses = asyncio.run(run_concurrently(
+                    options['requests'], options['concurrency'],
+                    lambda index: asgi_request(application, 'GET', path, headers)))
+                stats = summarize(latencies)
+                errors = sum(1 for status in statuses if status >= 400)
+                self.stdout.write(f'{name:<16}{kind:<7}{len(latencies) / elapsed:>10.1f}'
+                                  f'{stats["p50"] * 1000:>10.2f}{stats["p99"] * 1000:>10.2f}{errors:>8}')
@@ -0,0 +1,55 @@
+import asyncio
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve
+
+from app.benchmarking import histogram, load_traffic, replay_traffic, summarize
+
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def endpoint_name(path):
+    try:
+        return resolve(urlsplit(path).path).view_name
+    except Resolver404:
+        return 'unresolved'
+
+
+class Command(BaseCommand):
+    help = 'Replays REST traffic recorded by TrafficRecorderMiddleware against the ASGI application in-process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL file written by TrafficRecorderMiddleware')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--speed', type=float, default=0,
+                            help='Replay the recorded schedule this many times faster, 0 sends as fast as possible')
+
+    def handle(self, *args, **options):
+        from auction_house.asgi import application
+
+        try:
+            records = load_traffic(options['path'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read traffic from {options["path"]}: {e}')
+        records.sort(key=lambda record: record['time'])
+
+        elapsed, results = asyncio.run(replay_traffic(application, records, options['concurrency'],
+                                                      options['speed']))
+        by_endpoint = defaultdict(list)
+        for record, status, latency in results:
+            by_endpoint[endpoint_name(record['path'])].append((status, latency))
+
+        self.stdout.write(f'{len(results)} requests in {elapsed:.2f}s, {len(results) / elapsed:.1f} req/s')
+        bounds = ' '.join(f'<{bound}' for bound in HISTOGRAM_BOUNDS_MS)
+        self.stdout.write(f'{"endpoint":<32}{"count":>7}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}  '
+                          f'histogram ms ({bounds} >={HISTOGRAM_BOUNDS_MS[-1]})')
+        for name, samples in sorted(by_endpoint.items()):
+            latencies = [latency for _, latency in samples]
+            stats = summarize(latencies)
+            errors = sum(1 for status, _ in samples if status >= 400) / len(samples)
+            counts = histogram([latency * 1000 for latency in latencies], HISTOGRAM_BOUNDS_MS)
+            self.stdout.write(f'{name:<32}{len(samples):>7}{errors:>8.1%}{stats["p50"] * 1000:>10.2f}'
+                              f'{stats["p95"] * 1000:>10.2f}{stats["p99"] * 1000:>10.2f}  '
+                              f'{" ".join(str(count) for count in counts)}')
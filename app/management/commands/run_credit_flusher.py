@@ -0,0 +1,33 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+
+from app.models import PendingCredit
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Folds the journaled seller credits of DEFERRED_CREDITS mode into the wallets in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=float, default=0.005,
+                            help='Seconds to wait when the journal is empty')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Flushing pending credits')
+        try:
+            while True:
+                try:
+                    flushed = PendingCredit.flush(options['batch_size'])
+                except DatabaseError:
+                    # The batch rolled back and stays in the journal for the next pass
+                    logger.exception('Flushing pending credits failed')
+                    flushed = 0
+                if flushed < options['batch_size']:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
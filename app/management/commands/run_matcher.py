@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from app.matching import run_partition
+
+
+class Command(BaseCommand):
+    help = 'Matches queued orders with one worker process per item partition'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, default=os.cpu_count(),
+                            help='Number of partitions the items are hashed into')
+        parser.add_argument('--partition', type=int,
+                            help='Only run the worker of this partition, for running the workers as separate services')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=0.05, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        partitions = options['partitions']
+        worker_options = (options['batch_size'], options['poll_interval'])
+        if options['partition'] is not None:
+            if not 0 <= options['partition'] < partitions:
+                raise CommandError(f'Partition must be between 0 and {partitions - 1}')
+            self.stdout.write(f'Matching partition {options["partition"]} of {partitions}')
+            run_partition(options['partition'], partitions, *worker_options)
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        workers = [multiprocessing.Process(target=run_partition, args=(partition, partitions, *worker_options),
+                                           daemon=True)
+                   for partition in range(partitions)]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Matching {partitions} partitions')
+        try:
+            for worker in workers:
+                worker.join()
+                if worker.exitcode:
+                    raise CommandError(f'Matcher worker exited with {worker.exitcode}')
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,99 @@
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+
+from app.metrics import ORDER_FILLS, ORDER_LEVELS_SWEPT
+
+
+def book_group_name(item_id):
+    return f'book.{item_id}'
+
+
+def side_name(listing):
+    return 'buy' if listing.direction == listing.Direction.BUY else 'sell'
+
+
+# Collects the level and trade changes one write makes to the books, bumps their versions, appends the trades to the
+# ledger and publishes the changes as count and order increments per price level once the transaction commits
+class BookChanges:
+    def __init__(self):
+        self.levels = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        self.trades = defaultdict(list)
+        self.fills = defaultdict(list)
+
+    def listing_added(self, listing):
+        self.change_level(listing, listing.count, 1)
+
+    def listing_removed(self, listing):
+        self.change_level(listing, -listing.count, -1)
+
+    def listing_filled(self, listing, count, taker_id):
+        if count <= 0:
+            return
+        self.change_level(listing, -count, -1 if count == listing.count else 0)
+        if listing.direction == listing.Direction.BUY:
+            taker_side, buyer_id, seller_id = 'sell', listing.submitter_id, taker_id
+        else:
+            taker_side, buyer_id, seller_id = 'buy', taker_id, listing.submitter_id
+        self.trades[listing.item_id].append({'side': taker_side, 'price': listing.price, 'count': count})
+        self.fills[listing.item_id].append((buyer_id, seller_id))
+
+    def change_level(self, listing, count, orders):
+        level = self.levels[listing.item_id][side_name(listing), listing.price]
+        level[0] += count
+        level[1] += orders
+
+    def save(self):
+        from app.models import Item
+
+        trade_counts = {item_id: len(trades) for item_id, trades in self.trades.items()}
+        books = Item.bump_book_versions(self.levels.keys() | self.trades.keys(), trade_counts)
+        self.save_trades(books)
+        events = [(item_id, self.event(item_id, version)) for item_id, (version, _) in books.items()]
+        fills = sum(len(trades) for trades in self.trades.values())
+        levels_swept = len({(item_id, trade['side'], trade['price'])
+                            for item_id, trades in self.trades.items() for trade in trades})
+        transaction.on_commit(lambda: self.committed(events, fills, levels_swept))
+
+    @staticmethod
+    def committed(events, fills, levels_swept):
+        if fills:
+            ORDER_FILLS.inc(fills)
+            ORDER_LEVELS_SWEPT.inc(levels_swept)
+        publish(events)
+
+    def save_trades(self, books):
+        from app.models import Candle, Listing, Trade
+
+        timestamp = timezone.now()
+        directions = {'buy': Listing.Direction.BUY, 'sell': Listing.Direction.SELL}
+        ledger = []
+        for item_id, trades in self.trades.items():
+            last_sequence = books[item_id][1]
+            sequences = range(last_sequence - len(trades) + 1, last_sequence + 1)
+            for sequence, trade, (buyer_id, seller_id) in zip(sequences, trades, self.fills[item_id]):
+                ledger.append(Trade(item_id=item_id, buyer_id=buyer_id, seller_id=seller_id, price=trade['price'],
+                                    count=trade['count'], taker_direction=directions[trade['side']],
+                                    timestamp=timestamp, sequence=sequence))
+        if ledger:
+            Trade.objects.bulk_create(ledger)
+            Candle.add_trades(ledger)
+
+    def event(self, item_id, version):
+        return {
+            'type': 'book.changes',
+            'version': version,
+            'levels': [[side, price, count, orders] for (side, price), (count, orders) in self.levels[item_id].items()],
+            'trades': self.trades[item_id],
+        }
+
+
+def publish(events):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for item_id, event in events:
+        async_to_sync(channel_layer.group_send)(book_group_name(item_id), event)
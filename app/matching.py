@@ -0,0 +1,93 @@
+import logging
+import time
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from app.errors import FailedToCreateListingError, FailedToMakeTransactionError
+from app.models import InventoryItem, Order
+
+logger = logging.getLogger(__name__)
+
+# Attempts an order gets before it is failed, otherwise an order that keeps erroring would block its partition forever
+MAX_ATTEMPTS = 5
+
+# Queued orders are matched by worker processes that each own the items hashing to their partition, so books in
+# different partitions are matched in parallel. The queue only takes the REST buy and sell orders: the HTML buy and sell
+# forms, listing cancels and the batch endpoint still write books in the request. A book therefore has one writer for
+# orders but not in general, and writers stay correct by taking the book lock (Item.lock_books).
+
+
+def pending_orders(partition, partitions):
+    return Order.objects.filter(status=Order.Status.PENDING).alias(partition=Mod('item_id', partitions)) \
+        .filter(partition=partition).select_related('user', 'item').order_by('pk')
+
+
+def order_result(order):
+    from app.rest.views import listing_order_result
+
+    if order.kind == Order.Kind.BUY:
+        return order.item.make_buy_transaction(order.user, order.count)
+    if order.kind == Order.Kind.BUY_LISTING:
+        return listing_order_result(order.item.make_buy_listing(order.user, order.count, order.price))
+    inventory_item = InventoryItem.objects.filter(user=order.user, item=order.item).first()
+    if inventory_item is None:
+        raise FailedToCreateListingError('User does not have enough items')
+    if order.kind == Order.Kind.SELL:
+        return inventory_item.make_sell_transaction(order.count)
+    return listing_order_result(inventory_item.make_sell_listing(order.count, order.price))
+
+
+def start_attempt(order):
+    # Counted outside the order's transaction, so attempts that end in an error and roll back still count
+    pending = Order.objects.filter(pk=order.pk, status=Order.Status.PENDING)
+    if pending.filter(attempts__lt=MAX_ATTEMPTS).update(attempts=F('attempts') + 1):
+        return True
+    pending.update(status=Order.Status.FAILED, error='Order could not be processed', processed_at=timezone.now())
+    return False
+
+
+@transaction.atomic
+def execute(order):
+    # Claiming the row keeps a second worker serving the same partition from running the order again
+    if not Order.objects.select_for_update(skip_locked=True).filter(pk=order.pk, status=Order.Status.PENDING) \
+            .values_list('pk'):
+        return
+    # The order's effects and its status commit together, a worker dying halfway leaves it pending to be redone
+    try:
+        with transaction.atomic():
+            order.result = order_result(order)
+            order.status = Order.Status.DONE
+    except (FailedToCreateListingError, FailedToMakeTransactionError) as e:
+        order.status = Order.Status.FAILED
+        order.error = e.msg
+    order.processed_at = timezone.now()
+    order.save(update_fields=['result', 'status', 'error', 'processed_at'])
+
+
+def process_pending(partition, partitions, batch_size):
+    orders = list(pending_orders(partition, partitions)[:batch_size])
+    for order in orders:
+        if not start_attempt(order):
+            continue
+        try:
+            execute(order)
+        except Exception:
+            # The order rolled back and stays pending, it is retried on the next pass until it runs out of attempts
+            logger.exception('Order %s failed', order.pk)
+    return len(orders)
+
+
+def run_partition(partition, partitions, batch_size, poll_interval):
+    while True:
+        try:
+            processed = process_pending(partition, partitions, batch_size)
+        except Exception:
+            logger.exception('Matching partition %s failed', partition)
+            # Reconnects on the next pass if the error broke the connection
+            close_old_connections()
+            processed = 0
+        if not processed:
+            time.sleep(poll_interval)
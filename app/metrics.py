@@ -0,0 +1,169 @@
+import bisect
+import threading
+import time
+
+from django.http import HttpResponse
+
+# Process-local metrics in the Prometheus text format. Every thread updates its own shard, so recording never takes a
+# lock or contends with another worker thread, and a scrape sums the shards of all threads that have recorded anything
+
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            # Taken once per thread, recording afterwards only touches the thread's own dict
+            shard = self.local.shard = {}
+            with self.shards_lock:
+                self.shards.append(shard)
+            return shard
+
+    def collect(self, name):
+        with self.shards_lock:
+            shards = list(self.shards)
+        values = []
+        for shard in shards:
+            # dict.copy does not release the GIL, so it cannot observe a shard mid-update
+            values.extend((key[1], value) for key, value in shard.copy().items() if key[0] == name)
+        return values
+
+    def exposition(self):
+        return ''.join(metric.exposition() for metric in self.metrics)
+
+
+registry = Registry()
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, description, registry=registry):
+        self.name = name
+        self.description = description
+        self.registry = registry
+        registry.metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        shard = self.registry.shard()
+        key = (self.name, label_key(labels))
+        shard[key] = shard.get(key, 0) + amount
+
+    def totals(self):
+        totals = {}
+        for labels, amount in self.registry.collect(self.name):
+            totals[labels] = totals.get(labels, 0) + amount
+        return totals
+
+    def value(self, **labels):
+        return self.totals().get(label_key(labels), 0)
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.description}\n', f'# TYPE {self.name} {self.type}\n']
+        for labels, amount in sorted(self.totals().items()):
+            lines.append(f'{self.name}{format_labels(labels)} {amount}\n')
+        return ''.join(lines)
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS, registry=registry):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.registry = registry
+        registry.metrics.append(self)
+
+    def observe(self, amount, **labels):
+        shard = self.registry.shard()
+        key = (self.name, label_key(labels))
+        value = shard.get(key)
+        if value is None:
+            value = shard[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+        value[0][bisect.bisect_left(self.buckets, amount)] += 1
+        value[1] += amount
+        value[2] += 1
+
+    def totals(self):
+        totals = {}
+        for labels, (counts, amount, count) in self.registry.collect(self.name):
+            total = totals.setdefault(labels, [[0] * (len(self.buckets) + 1), 0, 0])
+            total[0] = [a + b for a, b in zip(total[0], counts)]
+            total[1] += amount
+            total[2] += count
+        return totals
+
+    def count(self, **labels):
+        return self.totals().get(label_key(labels), [None, 0, 0])[2]
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.description}\n', f'# TYPE {self.name} {self.type}\n']
+        for labels, (counts, amount, count) in sorted(self.totals().items()):
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{format_labels((*labels, ("le", bound)))} {cumulative}\n')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {amount}\n')
+            lines.append(f'{self.name}_count{format_labels(labels)} {count}\n')
+        return ''.join(lines)
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time spent serving requests, by view')
+REQUESTS = Counter('http_requests_total', 'Requests served, by view, method and status')
+REQUEST_DB_QUERIES = Counter('http_request_db_queries_total', 'Database queries run while serving requests')
+REQUEST_DB_DURATION = Counter('http_request_db_duration_seconds_total',
+                              'Time spent in database queries while serving requests')
+RESPONSE_SIZE = Counter('http_response_size_bytes_total', 'Bytes of response bodies served')
+LOCK_WAIT = Histogram('lock_wait_seconds', 'Time spent acquiring book and wallet locks, by lock',
+                      buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5])
+LOCK_FAILURES = Counter('lock_failures_total', 'Lock acquisitions that failed, by lock and reason')
+ORDER_FILLS = Counter('order_fills_total', 'Listings filled by committed orders')
+ORDER_LEVELS_SWEPT = Counter('order_levels_swept_total', 'Price levels committed orders filled against')
+
+
+# Statements that wait for locks: row locks, the PostgreSQL book locks and the no-op UPDATE that Item.lock_books takes
+# SQLite's database lock with
+LOCK_STATEMENTS = ['FOR UPDATE', 'pg_advisory_xact_lock', '"book_version" = "app_item"."book_version"']
+
+
+# Database execute wrapper counting the statements run, the time spent in them and in the ones that take locks
+class QueryStats:
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.lock_wait = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.duration += elapsed
+            if any(statement in sql for statement in LOCK_STATEMENTS):
+                self.lock_wait += elapsed
+
+
+def metrics_view(request):
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,192 @@
+import cProfile
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from app.metrics import REQUEST_DB_DURATION, REQUEST_DB_QUERIES, REQUEST_DURATION, REQUESTS, RESPONSE_SIZE, \
+    QueryStats
+from app.profiling import QueryLog, profile_dir, save_capture, should_profile
+
+# These middlewares work in both modes. A single sync-only middleware makes Django run the whole chain in a worker
+# thread under ASGI, which would take the async views off the event loop.
+
+
+class AsyncCapableMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.call(request)
+
+
+# Execute wrappers of the request being served. Concurrent async requests run their queries on the one thread their
+# sync_to_async calls share, so every connection gets a single permanent wrapper that hands each query to the wrappers
+# of the request it runs for, which asgiref carries into that thread with the context.
+request_wrappers = ContextVar('request_wrappers', default=())
+
+
+def execute_request_wrappers(execute, sql, params, many, context):
+    for wrapper in reversed(request_wrappers.get()):
+        execute = functools.partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_request_wrappers(sender, connection, **kwargs):
+    if execute_request_wrappers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_request_wrappers)
+
+
+@contextmanager
+def request_execute_wrapper(wrapper):
+    token = request_wrappers.set(request_wrappers.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        request_wrappers.reset(token)
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    def call(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        with request_execute_wrapper(stats):
+            response = self.get_response(request)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        with request_execute_wrapper(stats):
+            response = await self.get_response(request)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, stats, duration):
+        view = getattr(request.resolver_match, 'view_name', None) or 'unresolved'
+        REQUEST_DURATION.observe(duration, view=view)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        REQUEST_DB_QUERIES.inc(stats.queries, view=view)
+        REQUEST_DB_DURATION.inc(stats.duration, view=view)
+        if not response.streaming:
+            RESPONSE_SIZE.inc(len(response.content), view=view)
+
+
+# Appends every REST request to a JSONL file in the shape replay_traffic plays back. Records hold the Authorization
+# header, so only enable it where the file is as protected as the token table.
+class TrafficRecorderMiddleware(AsyncCapableMiddleware):
+    def __init__(self, get_response):
+        self.path = getattr(settings, 'TRAFFIC_RECORD_PATH', None)
+        if not self.path:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.lock = threading.Lock()
+
+    def call(self, request):
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        # Read the body before the view consumes the stream
+        body = request.body.decode('utf-8', errors='replace')
+        started_at = time.time()
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.write(self.record(request, response, body, started_at, time.perf_counter() - start))
+        return response
+
+    async def __acall__(self, request):
+        if not request.path.startswith('/api/'):
+            return await self.get_response(request)
+        body = request.body.decode('utf-8', errors='replace')
+        started_at = time.time()
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        record = self.record(request, response, body, started_at, time.perf_counter() - start)
+        await sync_to_async(self.write, thread_sensitive=False)(record)
+        return response
+
+    def record(self, request, response, body, started_at, duration):
+        return {
+            'time': started_at,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'authorization': request.META.get('HTTP_AUTHORIZATION', ''),
+            'content_type': request.META.get('CONTENT_TYPE', ''),
+            'body': body,
+            'status': response.status_code,
+            'duration': duration,
+        }
+
+    def write(self, record):
+        line = json.dumps(record)
+        with self.lock, open(self.path, 'a') as traffic:
+            traffic.write(line + '\n')
+
+
+# Runs a request under cProfile when it carries an X-Profile header from a staff session or with PROFILE_TOKEN, and
+# answers with the name of the capture in X-Profile-Capture
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    def __init__(self, get_response):
+        if not profile_dir():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        # Only one profiler can be active per process, other requests asking for one are served unprofiled
+        self.capturing = threading.Lock()
+
+    def call(self, request):
+        if not should_profile(request) or not self.capturing.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            query_log = QueryLog()
+            start = time.perf_counter()
+            with request_execute_wrapper(query_log):
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+            duration = time.perf_counter() - start
+            response['X-Profile-Capture'] = save_capture(request, response, profiler, query_log, duration)
+        finally:
+            self.capturing.release()
+        return response
+
+    async def __acall__(self, request):
+        # Checking a staff session loads the user from the database, so only requests asking to be profiled pay for
+        # the thread hop
+        if not request.META.get('HTTP_X_PROFILE') or not await sync_to_async(should_profile)(request) \
+                or not self.capturing.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            # cProfile only sees the event loop thread, the work done in sync_to_async threads shows up as waits on
+            # them, with its queries in the SQL log
+            profiler = cProfile.Profile()
+            query_log = QueryLog()
+            start = time.perf_counter()
+            with request_execute_wrapper(query_log):
+                profiler.enable()
+                try:
+                    response = await self.get_response(request)
+                finally:
+                    profiler.disable()
+            duration = time.perf_counter() - start
+            response['X-Profile-Capture'] = await sync_to_async(save_capture, thread_sensitive=False)(
+                request, response, profiler, query_log, duration)
+        finally:
+            self.capturing.release()
+        return response
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_listing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['item', 'direction', 'price', 'id'], name='listing-sell-book'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['item', 'direction', '-price', 'id'], name='listing-buy-book'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['submitter', 'direction', '-id'], name='listing-submitter'),
+        ),
+    ]
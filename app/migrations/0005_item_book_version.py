@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_listing_book_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='book_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
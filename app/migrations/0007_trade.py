@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0006_item_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='trade_sequence',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Trade',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('taker_direction', models.IntegerField(choices=[(1, 'Buy'), (2, 'Sell')])),
+                ('timestamp', models.DateTimeField()),
+                ('sequence', models.PositiveBigIntegerField()),
+                ('buyer', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchases', to=settings.AUTH_USER_MODEL)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.item')),
+                ('seller', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['item', 'timestamp'], name='trade-item-timestamp'),
+        ),
+        migrations.AddConstraint(
+            model_name='trade',
+            constraint=models.UniqueConstraint(fields=('item', 'sequence'), name='unique-trade-item-sequence'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_trade'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Candle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval', models.IntegerField(choices=[(60, '1m'), (300, '5m'), (3600, '1h'), (86400, '1d')])),
+                ('start', models.DateTimeField()),
+                ('open', models.IntegerField()),
+                ('high', models.IntegerField()),
+                ('low', models.IntegerField()),
+                ('close', models.IntegerField()),
+                ('volume', models.BigIntegerField()),
+                ('turnover', models.BigIntegerField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.item')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='candle',
+            constraint=models.UniqueConstraint(fields=('item', 'interval', 'start'), name='unique-candle-item-interval-start'),
+        ),
+    ]
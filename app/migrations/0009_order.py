@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0008_candle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.IntegerField(choices=[(1, 'Buy'), (2, 'Buy Listing'), (3, 'Sell'), (4, 'Sell Listing')])),
+                ('count', models.IntegerField()),
+                ('price', models.IntegerField(null=True)),
+                ('status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Done'), (3, 'Failed')], default=1)),
+                ('result', models.JSONField(null=True)),
+                ('error', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(null=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'id'], name='order-queue'),
+        ),
+    ]
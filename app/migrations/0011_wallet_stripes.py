@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_pendingcredit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='stripes',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='WalletStripe',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('coins', models.IntegerField(default=0)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripe_set', to='app.wallet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='walletstripe',
+            constraint=models.UniqueConstraint(fields=('wallet', 'index'), name='unique-wallet-stripe'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_wallet_stripes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -1,13 +1,49 @@
+import operator
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from functools import reduce
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models, transaction
+from django.db import OperationalError, connection, models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.utils import timezone
 
 from app.errors import FailedToCreateListingError, FailedToMakeTransactionError, CannotAffordError, \
-    InvalidTransactionError
+    InvalidTransactionError, MissingWalletStripesError, StripingChangedError
+from app.market_data import BookChanges
+from app.metrics import LOCK_FAILURES, LOCK_WAIT
+
+# First key of the PostgreSQL advisory locks guarding the books, the second one is the item id
+BOOK_LOCK_NAMESPACE = 1
+DEADLOCK_DETECTED = '40P01'
+# Credits that miss a wallet because set_stripes moved its coins are retried this many times. Missing it every time
+# means its stripe rows do not match its stripes count.
+STRIPING_RETRIES = 5
+
+
+@contextmanager
+def timed_lock(name):
+    start = time.perf_counter()
+    try:
+        yield
+    except OperationalError as e:
+        reason = 'deadlock' if getattr(e.__cause__, 'pgcode', None) == DEADLOCK_DETECTED else 'timeout'
+        LOCK_FAILURES.inc(lock=name, reason=reason)
+        raise
+    finally:
+        LOCK_WAIT.observe(time.perf_counter() - start, lock=name)
 
 
 class Wallet(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     coins = models.IntegerField(default=0)
+    # High-volume accounts keep their coins in this many WalletStripe rows instead of in coins, so fills crediting
+    # them update one of several rows rather than all queueing on the same one
+    stripes = models.PositiveSmallIntegerField(default=0)
 
     def __str__(self):
         return f'{self.user}-has-{self.coins}'
@@ -15,50 +51,238 @@ class Wallet(models.Model):
     @staticmethod
     def get_users_wallet(user: User):
         try:
-            return Wallet.objects.get(user=user)
+            wallet = Wallet.objects.get(user=user)
         except Wallet.DoesNotExist:
             return Wallet.objects.create(user=user)
+        if wallet.stripes:
+            wallet.coins = wallet.stripe_set.aggregate(coins=Sum('coins'))['coins'] or 0
+        return wallet
 
-    @transaction.atomic
     def add(self, coins):
-        self.refresh_from_db()
-        self.coins += coins
-        self.save()
+        # set_stripes may have changed the striping since this instance was loaded, a credit that finds no row to go
+        # to is retried with the striping read again
+        for _ in range(STRIPING_RETRIES):
+            if self.credit_row(coins):
+                self.coins += coins
+                return
+            self.stripes = Wallet.objects.values_list('stripes', flat=True).get(pk=self.pk)
+        raise MissingWalletStripesError()
+
+    def credit_row(self, coins):
+        if self.stripes:
+            return WalletStripe.objects.filter(wallet_id=self.pk, index=random.randrange(self.stripes)) \
+                .update(coins=F('coins') + coins)
+        return Wallet.objects.filter(pk=self.pk, stripes=0).update(coins=F('coins') + coins)
+
+    def balance(self):
+        # Credits still waiting in the journal already belong to the user, they just cannot be spent until flushed
+        pending = PendingCredit.objects.filter(user_id=self.user_id).aggregate(coins=Sum('coins'))['coins']
+        return self.coins + (pending or 0)
 
-    @transaction.atomic
     def spend(self, coins):
-        self.refresh_from_db()
-        if coins > self.coins:
-            raise CannotAffordError()
+        while not self.debit_rows(coins):
+            # Only a failure with the current striping means the wallet cannot afford it
+            stripes = Wallet.objects.values_list('stripes', flat=True).get(pk=self.pk)
+            if stripes == self.stripes:
+                raise CannotAffordError()
+            self.stripes = stripes
         self.coins -= coins
-        self.save()
+
+    def debit_rows(self, coins):
+        if self.stripes:
+            return self.spend_from_stripes(coins)
+        # The balance check is part of the UPDATE, so concurrent debits can never overdraw the wallet
+        return Wallet.objects.filter(pk=self.pk, stripes=0, coins__gte=coins).update(coins=F('coins') - coins)
+
+    def spend_from_stripes(self, coins):
+        # Debits lock every stripe in index order and drain them in that order, credits only ever lock a single one
+        stripes = list(self.stripe_set.select_for_update().order_by('index'))
+        if sum(stripe.coins for stripe in stripes) < coins:
+            return False
+        for stripe in stripes:
+            if not coins:
+                break
+            take = min(stripe.coins, coins)
+            if take:
+                WalletStripe.objects.filter(pk=stripe.pk).update(coins=F('coins') - take)
+                coins -= take
+        return True
+
+    @transaction.atomic
+    def set_stripes(self, stripes):
+        wallet = Wallet.lock_users([self.user_id])[0]
+        # Locking the stripes waits out credits already made to them, so none is left behind on a deleted stripe
+        coins = wallet.coins + sum(stripe.coins for stripe in wallet.stripe_set.select_for_update().order_by('index'))
+        wallet.stripe_set.all().delete()
+        WalletStripe.objects.bulk_create([WalletStripe(wallet=wallet, index=index, coins=coins if index == 0 else 0)
+                                          for index in range(stripes)])
+        Wallet.objects.filter(pk=wallet.pk).update(coins=0 if stripes else coins, stripes=stripes)
+        self.coins = coins
+        self.stripes = stripes
+
+    @staticmethod
+    def lock_users(user_ids):
+        return Wallet.lock(Q(user_id__in=user_ids))
+
+    @staticmethod
+    def lock(condition):
+        # Always lock in primary key order so transactions touching the same wallets cannot deadlock
+        with timed_lock('wallet'):
+            return list(Wallet.objects.select_for_update().filter(condition).order_by('pk'))
+
+    @staticmethod
+    def lock_for_settlement(debited_user_ids, credited_user_ids):
+        # Deferred credits only append to the journal and striped wallets are credited on a single stripe, neither
+        # needs the wallet row locked
+        if settings.DEFERRED_CREDITS:
+            credited_user_ids = []
+        return Wallet.lock(Q(user_id__in=debited_user_ids) | Q(user_id__in=credited_user_ids, stripes=0))
+
+    @staticmethod
+    def credit_users(coins_by_user_id):
+        if settings.DEFERRED_CREDITS:
+            PendingCredit.objects.bulk_create([PendingCredit(user_id=user_id, coins=coins)
+                                               for user_id, coins in coins_by_user_id.items() if coins])
+        else:
+            Wallet.add_to_users(coins_by_user_id)
+
+    @staticmethod
+    def add_to_users(coins_by_user_id):
+        if not coins_by_user_id:
+            return
+        Wallet.objects.bulk_create([Wallet(user_id=user_id) for user_id in coins_by_user_id], ignore_conflicts=True)
+        # set_stripes can move a wallet between its row and its stripes while it is being credited. The credits then
+        # miss it, so they are rolled back and made again with the striping read anew.
+        for _ in range(STRIPING_RETRIES):
+            try:
+                with transaction.atomic():
+                    Wallet.credit_rows(coins_by_user_id)
+                return
+            except StripingChangedError:
+                pass
+        raise MissingWalletStripesError()
+
+    @staticmethod
+    def credit_rows(coins_by_user_id):
+        credited = Wallet.objects.filter(user_id__in=coins_by_user_id, stripes=0).update(coins=F('coins') + Case(
+            *[When(user_id=user_id, then=Value(coins)) for user_id, coins in coins_by_user_id.items()],
+            output_field=models.IntegerField()
+        ))
+        if credited == len(coins_by_user_id):
+            return
+        # The rest are striped, each of them gets its credit on a random stripe. The wallets credited above stay locked
+        # until commit, so they cannot turn up among the striped ones.
+        picks = {}
+        for pk, user_id, stripes in Wallet.objects.filter(user_id__in=coins_by_user_id, stripes__gt=0) \
+                .values_list('pk', 'user_id', 'stripes'):
+            picks[pk] = (random.randrange(stripes), coins_by_user_id[user_id])
+        if credited + len(picks) != len(coins_by_user_id):
+            raise StripingChangedError()
+        updated = WalletStripe.objects.filter(reduce(operator.or_, (Q(wallet_id=pk, index=index)
+                                                                    for pk, (index, _) in picks.items()))) \
+            .update(coins=F('coins') + Case(
+                *[When(wallet_id=pk, then=Value(coins)) for pk, (_, coins) in picks.items()],
+                output_field=models.IntegerField()
+            ))
+        if updated != len(picks):
+            raise StripingChangedError()
+
+
+class WalletStripe(models.Model):
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='stripe_set')
+    index = models.PositiveSmallIntegerField()
+    coins = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'index'], name='unique-wallet-stripe')
+        ]
+
+    def __str__(self):
+        return f'{self.wallet.user}-stripe-{self.index}-has-{self.coins}'
+
+
+# Seller credits recorded by settlement in deferred mode. Inserting into the journal never waits on a popular seller's
+# wallet row, flush folds the credits into the wallets in batches.
+class PendingCredit(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    coins = models.IntegerField()
+
+    def __str__(self):
+        return f'{self.user_id}-pending-{self.coins}'
+
+    @staticmethod
+    @transaction.atomic
+    def flush(batch_size):
+        credits = list(PendingCredit.objects.select_for_update(skip_locked=True).order_by('pk')[:batch_size])
+        if not credits:
+            return 0
+        coins_by_user_id = defaultdict(int)
+        for credit in credits:
+            coins_by_user_id[credit.user_id] += credit.coins
+        Wallet.lock_users(coins_by_user_id)
+        Wallet.add_to_users(coins_by_user_id)
+        PendingCredit.objects.filter(pk__in=[credit.pk for credit in credits]).delete()
+        return len(credits)
 
 
 class Item(models.Model):
     name = models.CharField(max_length=200, unique=True)
+    book_version = models.PositiveIntegerField(default=0)
+    trade_sequence = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def lock_books(item_ids):
+        # Every write to a book takes its lock first and wallets only after it, so writers of one item are serialized
+        # and writers of different items only meet on wallet rows, which are always locked in the same order
+        with timed_lock('book'):
+            if connection.vendor == 'sqlite':
+                # SQLite only has a database lock. Writing first takes it up front, instead of failing with "database
+                # is locked" when a transaction that has only read so far tries to write. A queryset of ids stays a
+                # subquery of this UPDATE for the same reason.
+                Item.objects.filter(pk__in=item_ids).update(book_version=F('book_version'))
+            elif connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    for item_id in sorted(set(item_ids)):
+                        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [BOOK_LOCK_NAMESPACE, item_id])
+            else:
+                list(Item.objects.select_for_update().filter(pk__in=item_ids).order_by('pk').values_list('pk'))
+
+    @staticmethod
+    def bump_book_versions(item_ids, trade_counts=None):
+        updates = {'book_version': F('book_version') + 1}
+        if trade_counts:
+            # Trade sequences are handed out per item by advancing its counter in the same UPDATE
+            updates['trade_sequence'] = F('trade_sequence') + Case(
+                *[When(pk=item_id, then=Value(count)) for item_id, count in trade_counts.items()], default=Value(0))
+        Item.objects.filter(pk__in=item_ids).update(**updates)
+        # The UPDATE holds the rows until commit, so the values read back are the ones this transaction wrote
+        rows = Item.objects.filter(pk__in=item_ids).values_list('pk', 'book_version', 'trade_sequence')
+        return {pk: (book_version, trade_sequence) for pk, book_version, trade_sequence in rows}
+
     @transaction.atomic
     def add_to_user_inventory(self, user: User, count):
-        try:
-            inventory_item = InventoryItem.objects.get(user=user, item=self)
-            inventory_item.count += count
-            inventory_item.save()
-            return inventory_item
-        except InventoryItem.DoesNotExist:
-            return InventoryItem.objects.create(user=user, item=self, count=count)
+        InventoryItem.add_many({(user.pk, self.pk): count})
 
     @transaction.atomic
     def make_buy_transaction(self, user: User, count):
+        if count <= 0:
+            raise FailedToMakeTransactionError("Count must be positive")
+        Item.lock_books([self.pk])
         wallet = Wallet.get_users_wallet(user)
         remaining_purchase_count = count
         coins_spent = 0
-        listings = Listing.objects.filter(item=self, direction=Listing.Direction.SELL).order_by('price')
-        if not listings:
-            raise FailedToMakeTransactionError('No listings')
-        for listing in listings:
+        has_listings = False
+        fills = []
+        seller_credits = defaultdict(int)
+        for listing in Listing.objects.sell_side(self).iterator():
+            has_listings = True
+            if not remaining_purchase_count:
+                break
             if listing.count > remaining_purchase_count:
                 take = remaining_purchase_count
             else:
@@ -66,20 +290,31 @@ class Item(models.Model):
 
             price = take * listing.price
 
-            try:
-                wallet.spend(price)
-            except CannotAffordError:
+            if coins_spent + price > wallet.coins:
                 # TODO: make partial purchase
                 break
 
             coins_spent += price
             remaining_purchase_count -= take
 
-            listing.process_purchase(take)
+            fills.append((listing, take))
+            seller_credits[listing.submitter_id] += price
+
+        if not has_listings:
+            raise FailedToMakeTransactionError('No listings')
 
         items_purchased = count - remaining_purchase_count
         if items_purchased:
+            Wallet.lock_for_settlement([user.pk], seller_credits)
+            try:
+                wallet.spend(coins_spent)
+            except CannotAffordError:
+                raise FailedToMakeTransactionError('User does not have enough money')
+            Wallet.credit_users(seller_credits)
+            changes = BookChanges()
+            Listing.apply_fills(fills, changes, user.pk)
             self.add_to_user_inventory(user, items_purchased)
+            changes.save()
         return {
             'items_purchased': items_purchased,
             'coins_spent': coins_spent
@@ -87,19 +322,42 @@ class Item(models.Model):
 
     @transaction.atomic
     def make_buy_listing(self, user: User, count, price):
-        wallet = Wallet.get_users_wallet(user)
+        if count <= 0 or price <= 0:
+            raise FailedToCreateListingError("Count and price must be positive")
 
-        if wallet.coins < price:
-            raise FailedToCreateListingError("User does not have enough money")
+        Item.lock_books([self.pk])
+        wallet = Wallet.get_users_wallet(user)
 
-        listing = Listing.objects.filter(item=self, direction=Listing.Direction.SELL).order_by('price').first()
-        if listing and listing.price <= price:
-            raise FailedToCreateListingError("Cannot make listing when buy price is higher than lowest sell listing")
+        fills = Listing.plan_fills(Listing.objects.sell_side(self).filter(price__lte=price), count)
+        seller_credits = defaultdict(int)
+        for listing, take in fills:
+            seller_credits[listing.submitter_id] += take * listing.price
+        items_purchased = sum(take for _, take in fills)
+        coins_spent = sum(seller_credits.values())
+        remaining_count = count - items_purchased
 
-        wallet.spend(price)
+        Wallet.lock_for_settlement([user.pk], seller_credits)
+        try:
+            wallet.spend(coins_spent + remaining_count * price)
+        except CannotAffordError:
+            raise FailedToCreateListingError("User does not have enough money")
 
-        return Listing.objects.create(item=self, count=count, price=price, direction=Listing.Direction.BUY,
-                                      submitter=user)
+        listing = None
+        changes = BookChanges()
+        if items_purchased:
+            Wallet.credit_users(seller_credits)
+            Listing.apply_fills(fills, changes, user.pk)
+            self.add_to_user_inventory(user, items_purchased)
+        if remaining_count:
+            listing = Listing.objects.create(item=self, count=remaining_count, price=price,
+                                             direction=Listing.Direction.BUY, submitter=user)
+            changes.listing_added(listing)
+        changes.save()
+        return {
+            'listing': listing,
+            'items_purchased': items_purchased,
+            'coins_spent': coins_spent
+        }
 
 
 class InventoryItem(models.Model):
@@ -115,18 +373,99 @@ class InventoryItem(models.Model):
 
     @transaction.atomic
     def make_sell_listing(self, count, price):
+        if count <= 0 or price <= 0:
+            raise FailedToCreateListingError("Count and price must be positive")
+        self.lock_book()
         if self.count < count:
             raise FailedToCreateListingError("User does not have enough items")
 
-        listing = Listing.objects.filter(item=self.item, direction=Listing.Direction.BUY).order_by('-price').first()
-        if listing and listing.price >= price:
-            raise FailedToCreateListingError("Cannot make listing when sell price is lower than highest buy listing")
+        self.remove(count)
+
+        changes = BookChanges()
+        items_sold, coins_earned = self.sell_to_buy_listings(
+            Listing.objects.buy_side(self.item).filter(price__gte=price), count, changes)
+        remaining_count = count - items_sold
+
+        listing = None
+        if remaining_count:
+            listing = Listing.objects.create(item=self.item, count=remaining_count, price=price,
+                                             direction=Listing.Direction.SELL, submitter=self.user)
+            changes.listing_added(listing)
+        changes.save()
+        return {
+            'listing': listing,
+            'items_sold': items_sold,
+            'coins_earned': coins_earned
+        }
+
+    @transaction.atomic
+    def make_sell_transaction(self, count):
+        if count <= 0:
+            raise FailedToMakeTransactionError("Count must be positive")
+        self.lock_book()
+        if self.count < count:
+            raise FailedToMakeTransactionError("User does not have enough items")
+
+        buy_listings = Listing.objects.buy_side(self.item)
+        if not buy_listings.exists():
+            raise FailedToMakeTransactionError('No listings')
 
+        changes = BookChanges()
+        items_sold, coins_earned = self.sell_to_buy_listings(buy_listings, count, changes)
+        if items_sold:
+            self.remove(items_sold)
+            changes.save()
+        return {
+            'items_sold': items_sold,
+            'coins_earned': coins_earned
+        }
+
+    def lock_book(self):
+        # Inventory of an item only changes under its book lock, so the count read after taking it stays current
+        Item.lock_books([self.item_id])
+        self.refresh_from_db(fields=['count'])
+
+    @staticmethod
+    def add_many(counts_by_user_and_item_id):
+        # A single upsert adds to the rows that exist and creates the missing ones, so there is no read first and two
+        # transactions creating the same row cannot both insert it. Rows go in key order to lock them in a fixed order.
+        rows = [(user_id, item_id, count) for (user_id, item_id), count in sorted(counts_by_user_and_item_id.items())
+                if count]
+        if not rows:
+            return
+        quote = connection.ops.quote_name
+        table, count_column = quote(InventoryItem._meta.db_table), quote('count')
+        if connection.vendor == 'mysql':
+            conflict = f'ON DUPLICATE KEY UPDATE {count_column} = {count_column} + VALUES({count_column})'
+        else:
+            conflict = (f'ON CONFLICT ({quote("user_id")}, {quote("item_id")}) '
+                        f'DO UPDATE SET {count_column} = {table}.{count_column} + excluded.{count_column}')
+        batch_size = connection.ops.bulk_batch_size(['user_id', 'item_id', 'count'], rows)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(f'INSERT INTO {table} ({quote("user_id")}, {quote("item_id")}, {count_column}) '
+                               f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} {conflict}',
+                               [value for row in batch for value in row])
+
+    def remove(self, count):
+        InventoryItem.objects.filter(pk=self.pk).update(count=F('count') - count)
         self.count -= count
-        self.save()
 
-        return Listing.objects.create(item=self.item, count=count, price=price, direction=Listing.Direction.SELL,
-                                      submitter=self.user)
+    def sell_to_buy_listings(self, buy_listings, count, changes):
+        fills = Listing.plan_fills(buy_listings, count)
+        buyer_items = defaultdict(int)
+        for listing, take in fills:
+            buyer_items[listing.submitter_id] += take
+        items_sold = sum(buyer_items.values())
+        coins_earned = sum(take * listing.price for listing, take in fills)
+
+        if items_sold:
+            # Buy listings hold their coins in escrow, so the seller is paid without touching the buyers' wallets
+            Wallet.credit_users({self.user_id: coins_earned})
+            Listing.apply_fills(fills, changes, self.user_id)
+            InventoryItem.add_many({(user_id, self.item_id): count for user_id, count in buyer_items.items()})
+        return items_sold, coins_earned
 
     class Meta:
         constraints = [
@@ -134,6 +473,42 @@ class InventoryItem(models.Model):
         ]
 
 
+class ListingQuerySet(models.QuerySet):
+    def sell_side(self, item):
+        return self.filter(item=item, direction=Listing.Direction.SELL).order_by('price', 'pk')
+
+    def buy_side(self, item):
+        return self.filter(item=item, direction=Listing.Direction.BUY).order_by('-price', 'pk')
+
+    def best_price(self):
+        return self.values_list('price', flat=True).first()
+
+    def levels(self):
+        # Grouping has to drop the pk tiebreaker from the ordering, otherwise every listing is its own level
+        ordering = [field for field in self.query.order_by if field.lstrip('-') == 'price']
+        return self.order_by(*ordering).values('price').annotate(total_count=Sum('count'), order_count=Count('pk'))
+
+    @transaction.atomic
+    def cancel(self):
+        Item.lock_books(self.values_list('item_id', flat=True))
+        listings = list(self.select_for_update())
+        refunds = defaultdict(int)
+        returned_items = defaultdict(int)
+        for listing in listings:
+            if listing.direction == Listing.Direction.BUY:
+                refunds[listing.submitter_id] += listing.price * listing.count
+            else:
+                returned_items[(listing.submitter_id, listing.item_id)] += listing.count
+        Wallet.add_to_users(refunds)
+        InventoryItem.add_many(returned_items)
+        Listing.objects.filter(pk__in=[listing.pk for listing in listings]).delete()
+        changes = BookChanges()
+        for listing in listings:
+            changes.listing_removed(listing)
+        changes.save()
+        return listings
+
+
 class Listing(models.Model):
     Direction = models.IntegerChoices('Direction', 'BUY SELL')
     int_to_direction = {k: v for k, v in Direction.choices}
@@ -144,31 +519,183 @@ class Listing(models.Model):
     direction = models.IntegerField(choices=Direction.choices)
     submitter = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    objects = ListingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'direction', 'price', 'id'], name='listing-sell-book'),
+            models.Index(fields=['item', 'direction', '-price', 'id'], name='listing-buy-book'),
+            models.Index(fields=['submitter', 'direction', '-id'], name='listing-submitter'),
+        ]
+
     def __str__(self):
         return f'{self.item.name}-{self.count}-{self.price}-{self.int_to_direction[self.direction]}-{self.submitter}'
 
     def description(self):
         return f'{self.count} of "{self.item}" for {self.price} coins'
 
+    @staticmethod
+    def plan_fills(listings, count):
+        fills = []
+        for listing in listings.iterator():
+            if not count:
+                break
+            take = min(listing.count, count)
+            fills.append((listing, take))
+            count -= take
+        return fills
+
+    @staticmethod
+    def apply_fills(fills, changes, taker_id):
+        for listing, take in fills:
+            changes.listing_filled(listing, take, taker_id)
+        filled_pks = [listing.pk for listing, take in fills if take == listing.count]
+        if filled_pks:
+            Listing.objects.filter(pk__in=filled_pks).delete()
+        for listing, take in fills:
+            if take < listing.count:
+                Listing.objects.filter(pk=listing.pk).update(count=F('count') - take)
+                listing.count -= take
+
     @transaction.atomic
-    def process_purchase(self, count):
+    def process_purchase(self, count, buyer: User = None):
         if self.direction != Listing.Direction.SELL:
             raise InvalidTransactionError()
+        if count <= 0:
+            raise ValueError("Count must be positive")
+        Item.lock_books([self.item_id])
+        # Other purchases may have taken from the listing since this instance was loaded
+        try:
+            self.refresh_from_db(fields=['count'])
+        except Listing.DoesNotExist:
+            self.count = 0
         if count > self.count:
             raise ValueError("Cannot take more items than listed")
-        wallet = Wallet.get_users_wallet(self.submitter)
-        wallet.add(self.price * count)
-        self.count -= count
-        if not self.count:
-            self.delete()
-        else:
-            self.save()
+        Wallet.credit_users({self.submitter_id: self.price * count})
+        changes = BookChanges()
+        Listing.apply_fills([(self, count)], changes, buyer.pk if buyer else None)
+        changes.save()
 
-    @transaction.atomic
     def cancel(self):
-        if self.direction == Listing.Direction.BUY:
-            wallet = Wallet.get_users_wallet(self.submitter)
-            wallet.add(self.price * self.count)
-        else:
-            self.item.add_to_user_inventory(self.submitter, self.count)
-        self.delete()
+        Listing.objects.filter(pk=self.pk).cancel()
+
+
+class Order(models.Model):
+    Kind = models.IntegerChoices('Kind', 'BUY BUY_LISTING SELL SELL_LISTING')
+    Status = models.IntegerChoices('Status', 'PENDING DONE FAILED')
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    kind = models.IntegerField(choices=Kind.choices)
+    count = models.IntegerField()
+    price = models.IntegerField(null=True)
+    status = models.IntegerField(choices=Status.choices, default=Status.PENDING)
+    result = models.JSONField(null=True)
+    error = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='order-queue'),
+        ]
+
+    def __str__(self):
+        return f'{self.pk}-{self.get_kind_display()}-{self.get_status_display()}'
+
+
+class Trade(models.Model):
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    # Trades outlive the accounts that made them
+    buyer = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='purchases')
+    seller = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='sales')
+    price = models.IntegerField()
+    count = models.IntegerField()
+    taker_direction = models.IntegerField(choices=Listing.Direction.choices)
+    timestamp = models.DateTimeField()
+    sequence = models.PositiveBigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'sequence'], name='unique-trade-item-sequence')
+        ]
+        indexes = [
+            models.Index(fields=['item', 'timestamp'], name='trade-item-timestamp'),
+        ]
+
+    def __str__(self):
+        return f'{self.item_id}-{self.sequence}-{self.count}-{self.price}'
+
+
+class Candle(models.Model):
+    class Interval(models.IntegerChoices):
+        MINUTE = 60, '1m'
+        FIVE_MINUTES = 300, '5m'
+        HOUR = 3600, '1h'
+        DAY = 86400, '1d'
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    interval = models.IntegerField(choices=Interval.choices)
+    start = models.DateTimeField()
+    open = models.IntegerField()
+    high = models.IntegerField()
+    low = models.IntegerField()
+    close = models.IntegerField()
+    volume = models.BigIntegerField()
+    turnover = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'interval', 'start'], name='unique-candle-item-interval-start')
+        ]
+
+    def __str__(self):
+        return f'{self.item_id}-{self.get_interval_display()}-{self.start.isoformat()}'
+
+    @property
+    def vwap(self):
+        return self.turnover / self.volume if self.volume else None
+
+    @staticmethod
+    def bucket_start(timestamp, interval):
+        seconds = int(timestamp.timestamp())
+        return datetime.fromtimestamp(seconds - seconds % interval, tz=timezone.utc)
+
+    @staticmethod
+    def add_trades(trades):
+        # Trades arrive in sequence order and settlement holds the rows of their items, so the candles can be read,
+        # merged and written back without racing another writer
+        candles = {}
+        for trade in trades:
+            for interval in Candle.Interval.values:
+                key = (trade.item_id, interval, Candle.bucket_start(trade.timestamp, interval))
+                candle = candles.get(key)
+                if candle is None:
+                    candles[key] = Candle(item_id=trade.item_id, interval=interval, start=key[2], open=trade.price,
+                                          high=trade.price, low=trade.price, close=trade.price, volume=trade.count,
+                                          turnover=trade.price * trade.count)
+                else:
+                    candle.merge(Candle(open=trade.price, high=trade.price, low=trade.price, close=trade.price,
+                                        volume=trade.count, turnover=trade.price * trade.count))
+        if not candles:
+            return
+
+        item_ids = {item_id for item_id, _, _ in candles}
+        starts = {start for _, _, start in candles}
+        existing = Candle.objects.filter(item_id__in=item_ids, start__in=starts)
+        updated = []
+        for candle in existing:
+            new = candles.pop((candle.item_id, candle.interval, candle.start), None)
+            if new is not None:
+                candle.merge(new)
+                updated.append(candle)
+        Candle.objects.bulk_update(updated, ['high', 'low', 'close', 'volume', 'turnover'])
+        Candle.objects.bulk_create(candles.values())
+
+    def merge(self, later):
+        self.high = max(self.high, later.high)
+        self.low = min(self.low, later.low)
+        self.close = later.close
+        self.volume += later.volume
+        self.turnover += later.turnover
@@ -0,0 +1,108 @@
+import json
+import os
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+
+# Single request profiles: a cProfile dump, the SQL the request ran and a JSON summary per capture, written to
+# PROFILE_DIR and listed on an admin page
+
+CAPTURE_NAME = re.compile(r'^[\w-]+$')
+CAPTURE_FILES = {'prof': 'application/octet-stream', 'sql': 'text/plain', 'json': 'application/json'}
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILE_DIR', None)
+
+
+def should_profile(request):
+    requested = request.META.get('HTTP_X_PROFILE')
+    if not requested:
+        return False
+    # Token auth only happens inside DRF views, so API clients unlock profiling with the shared secret instead
+    token = getattr(settings, 'PROFILE_TOKEN', None)
+    if token and requested == token:
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_staff)
+
+
+class QueryLog:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - start, sql, params))
+
+
+def save_capture(request, response, profiler, query_log, duration):
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    view = getattr(request.resolver_match, 'view_name', None) or 'unresolved'
+    slug = re.sub(r'[^\w-]', '-', view)
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{slug}-{uuid.uuid4().hex[:8]}'
+    path = os.path.join(directory, name)
+
+    profiler.dump_stats(f'{path}.prof')
+    with open(f'{path}.sql', 'w') as sql_log:
+        for query_duration, sql, params in query_log.queries:
+            sql_log.write(f'-- {query_duration * 1000:.3f} ms, params {params!r}\n{sql};\n\n')
+    with open(f'{path}.json', 'w') as summary:
+        json.dump({
+            'time': time.time(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view,
+            'status': response.status_code,
+            'duration': duration,
+            'queries': len(query_log.queries),
+            'query_duration': sum(query_duration for query_duration, _, _ in query_log.queries),
+        }, summary)
+    return name
+
+
+def list_captures(limit=100):
+    directory = profile_dir()
+    if not directory or not os.path.isdir(directory):
+        return []
+    captures = []
+    for file_name in os.listdir(directory):
+        name, extension = os.path.splitext(file_name)
+        if extension != '.json' or not CAPTURE_NAME.match(name):
+            continue
+        try:
+            with open(os.path.join(directory, file_name)) as summary:
+                captures.append({'name': name, **json.load(summary)})
+        except (OSError, ValueError):
+            continue
+    captures.sort(key=lambda capture: capture['time'], reverse=True)
+    return captures[:limit]
+
+
+def profile_captures(request):
+    return TemplateResponse(request, 'admin/profile_captures.html', {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profile_dir': profile_dir(),
+        'captures': list_captures(),
+    })
+
+
+def profile_capture_file(request, name, extension):
+    directory = profile_dir()
+    if not directory or not CAPTURE_NAME.match(name) or extension not in CAPTURE_FILES:
+        raise Http404
+    path = os.path.join(directory, f'{name}.{extension}')
+    if not os.path.isfile(path):
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=extension == 'prof', filename=f'{name}.{extension}',
+                        content_type=CAPTURE_FILES[extension])
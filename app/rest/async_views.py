@@ -0,0 +1,153 @@
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from django.http import JsonResponse
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from app.rest.pagination import get_page_size, keyset_page
+from app.rest.serializers import *
+from app.rest.views import dashboard_data, item_listings_data
+
+# Async counterparts of the read-heavy REST endpoints: each request stays on the event loop and does all of its
+# database and serialization work in one worker thread hop, instead of running the whole DRF stack in a thread
+
+NOT_AUTHENTICATED = {'detail': 'Authentication credentials were not provided.'}
+NOT_FOUND = {'detail': 'Not found.'}
+MAX_ORDER_WAIT = 30
+ORDER_POLL_INTERVAL = 0.05
+# Reads also accept a logged-in session, so an order queued from the site can be read back. The DRF views, and with
+# them every write endpoint, stay token-only.
+AUTHENTICATION_CLASSES = [*api_settings.DEFAULT_AUTHENTICATION_CLASSES, SessionAuthentication]
+
+
+def request_user(request):
+    drf_request = Request(request, authenticators=[auth() for auth in AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user.is_authenticated else None
+
+
+def paginated_results(request, rows, build):
+    page, next_cursor = keyset_page(rows, request.GET.get('cursor'), get_page_size(request.GET))
+    next_link = None
+    if next_cursor is not None:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        next_link = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    return {'next': next_link, 'results': [build(row) for row in page]}
+
+
+def load_item_listings(request, pk):
+    item = Item.objects.filter(pk=pk).first()
+    return None if item is None else item_listings_data(item, request.GET)
+
+
+def load_dashboard(request):
+    user = request_user(request)
+    return None if user is None else dashboard_data(user, request.GET)
+
+
+def load_items(request):
+    return paginated_results(request, Item.objects.order_by('pk').values('id', 'name'), dict)
+
+
+def load_item(pk):
+    item = Item.objects.filter(pk=pk).first()
+    return None if item is None else ItemSerializer(item).data
+
+
+def load_inventory(request, pk=None):
+    user = request_user(request)
+    if user is None:
+        return None, None
+    inventory_items = InventoryItem.objects.filter(user=user).select_related('item').order_by('pk')
+    if pk is None:
+        return user, paginated_results(request, inventory_items.values(*INVENTORY_ITEM_VALUES), inventory_item_data)
+    inventory_item = inventory_items.filter(pk=pk).first()
+    return user, None if inventory_item is None else InventoryItemSerializer(inventory_item).data
+
+
+def load_order(request, pk):
+    user = request_user(request)
+    if user is None:
+        return None, None
+    order = Order.objects.filter(pk=pk, user=user).first()
+    return user, None if order is None else OrderSerializer(order).data
+
+
+def invalid_cursor_as_not_found(view):
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except NotFound as e:
+            return JsonResponse({'detail': str(e.detail)}, status=404)
+    return wrapper
+
+
+@invalid_cursor_as_not_found
+async def item_listings(request, pk):
+    data = await database_sync_to_async(load_item_listings)(request, pk)
+    if data is None:
+        return JsonResponse(NOT_FOUND, status=404)
+    return JsonResponse(data)
+
+
+@invalid_cursor_as_not_found
+async def dashboard(request):
+    data = await database_sync_to_async(load_dashboard)(request)
+    if data is None:
+        return JsonResponse(NOT_AUTHENTICATED, status=401)
+    return JsonResponse(data)
+
+
+@invalid_cursor_as_not_found
+async def item_list(request):
+    return JsonResponse(await database_sync_to_async(load_items)(request))
+
+
+async def item_detail(request, pk):
+    data = await database_sync_to_async(load_item)(pk)
+    if data is None:
+        return JsonResponse(NOT_FOUND, status=404)
+    return JsonResponse(data)
+
+
+@invalid_cursor_as_not_found
+async def inventory_list(request):
+    user, data = await database_sync_to_async(load_inventory)(request)
+    if user is None:
+        return JsonResponse(NOT_AUTHENTICATED, status=401)
+    return JsonResponse(data)
+
+
+async def inventory_detail(request, pk):
+    user, data = await database_sync_to_async(load_inventory)(request, pk)
+    if user is None:
+        return JsonResponse(NOT_AUTHENTICATED, status=401)
+    if data is None:
+        return JsonResponse(NOT_FOUND, status=404)
+    return JsonResponse(data)
+
+
+async def order_detail(request, pk):
+    # With ?wait=<seconds> a pending order is polled until a matcher has processed it or the wait runs out
+    try:
+        wait = min(max(float(request.GET.get('wait', 0)), 0), MAX_ORDER_WAIT)
+    except ValueError:
+        wait = 0
+    deadline = time.monotonic() + wait
+    while True:
+        user, data = await database_sync_to_async(load_order)(request, pk)
+        if user is None:
+            return JsonResponse(NOT_AUTHENTICATED, status=401)
+        if data is None:
+            return JsonResponse(NOT_FOUND, status=404)
+        if data['status'] != Order.Status.PENDING or time.monotonic() >= deadline:
+            return JsonResponse(data)
+        await asyncio.sleep(ORDER_POLL_INTERVAL)
@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+# Bounds of the 64 bit integer columns, a larger value makes the database driver fail instead of matching nothing
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+
+def decode_cursor(cursor, model_fields):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise NotFound('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(model_fields):
+        raise NotFound('Invalid cursor')
+    # Cursors come from clients, so every value is checked against its field before it reaches a query
+    try:
+        values = [model_field.to_python(value) for model_field, value in zip(model_fields, values)]
+    except ValidationError:
+        raise NotFound('Invalid cursor')
+    for value in values:
+        if value is None or isinstance(value, int) and not MIN_INTEGER <= value <= MAX_INTEGER:
+            raise NotFound('Invalid cursor')
+    return values
+
+
+def get_page_size(params):
+    try:
+        page_size = int(params.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def row_value(row, field, pk_name):
+    if isinstance(row, dict):
+        return row[pk_name if field == 'pk' else field]
+    return getattr(row, field)
+
+
+def keyset_page(queryset, cursor, page_size):
+    # The cursor holds the ordering values of the last row served, and the next page is everything after it in
+    # that ordering. Each page costs one index range scan however deep it is, and rows filled or cancelled in
+    # between cannot shift the next page the way they would with an offset.
+    ordering = queryset.query.order_by
+    fields = [field.lstrip('-') for field in ordering]
+    if cursor:
+        opts = queryset.model._meta
+        values = decode_cursor(cursor, [opts.pk if field == 'pk' else opts.get_field(field) for field in fields])
+        after = Q()
+        for index, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            after |= Q(**dict(zip(fields[:index], values[:index])), **{f'{fields[index]}__{lookup}': values[index]})
+        queryset = queryset.filter(after)
+    page = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        pk_name = queryset.model._meta.pk.attname
+        next_cursor = encode_cursor([row_value(page[-1], field, pk_name) for field in fields])
+    return page, next_cursor
+
+
+class KeysetPagination(BasePagination):
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page, self.next_cursor = keyset_page(queryset, request.query_params.get('cursor'),
+                                             get_page_size(request.query_params))
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), 'cursor', self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
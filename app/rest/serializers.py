@@ -10,6 +10,8 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class WalletSerializer(serializers.ModelSerializer):
+    coins = serializers.IntegerField(source='balance', read_only=True)
+
     class Meta:
         model = Wallet
         fields = ['user', 'coins']
@@ -35,10 +37,117 @@ class ListingSerializer(serializers.ModelSerializer):
         fields = ['id', 'item', 'count', 'price', 'direction', 'submitter', 'description']
 
 
+# Plain dict builders for the list-heavy read paths. They give the same output as ListingSerializer and
+# InventoryItemSerializer from values() rows, without per-row model instances or DRF field handling
+LISTING_VALUES = ['id', 'item_id', 'count', 'price', 'direction', 'submitter_id', 'item__name']
+INVENTORY_ITEM_VALUES = ['id', 'user_id', 'item_id', 'count', 'item__name']
+
+
+def listing_data(row):
+    return {
+        'id': row['id'],
+        'item': row['item_id'],
+        'count': row['count'],
+        'price': row['price'],
+        'direction': row['direction'],
+        'submitter': row['submitter_id'],
+        'description': f'{row["count"]} of "{row["item__name"]}" for {row["price"]} coins',
+    }
+
+
+def inventory_item_data(row):
+    return {
+        'id': row['id'],
+        'user': row['user_id'],
+        'item': {'id': row['item_id'], 'name': row['item__name']},
+        'count': row['count'],
+        'description': f'{row["count"]} of "{row["item__name"]}"',
+    }
+
+
+CANDLE_VALUES = ['start', 'open', 'high', 'low', 'close', 'volume', 'turnover']
+
+
+def candle_data(row):
+    return {
+        'start': row['start'],
+        'open': row['open'],
+        'high': row['high'],
+        'low': row['low'],
+        'close': row['close'],
+        'volume': row['volume'],
+        'vwap': row['turnover'] / row['volume'] if row['volume'] else None,
+    }
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ['id', 'item', 'kind', 'count', 'price', 'status', 'result', 'error', 'created_at', 'processed_at']
+
+
+class PriceLevelSerializer(serializers.Serializer):
+    price = serializers.IntegerField()
+    total_count = serializers.IntegerField()
+    order_count = serializers.IntegerField()
+
+
 class ListingRequestSerializer(serializers.Serializer):
     count = serializers.IntegerField()
     price = serializers.IntegerField()
 
 
 class ItemBuyRequestSerializer(serializers.Serializer):
-    count = serializers.IntegerField()
+    count = serializers.IntegerField(min_value=1)
+
+
+class DepthRequestSerializer(serializers.Serializer):
+    depth = serializers.IntegerField(min_value=1, max_value=1000, default=10)
+
+
+class CandleRequestSerializer(serializers.Serializer):
+    MAX_CANDLES = 1000
+
+    interval = serializers.ChoiceField(choices=Candle.Interval.labels, default='1m')
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+    def validate_interval(self, value):
+        return Candle.Interval.values[Candle.Interval.labels.index(value)]
+
+
+class InventoryMarketSellRequestSerializer(serializers.Serializer):
+    count = serializers.IntegerField(min_value=1)
+
+
+class OrderOperationSerializer(serializers.Serializer):
+    OPERATIONS = ['create', 'cancel', 'amend']
+    SIDES = ['buy', 'sell']
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    side = serializers.ChoiceField(choices=SIDES, required=False)
+    item = serializers.IntegerField(required=False)
+    listing = serializers.IntegerField(required=False)
+    count = serializers.IntegerField(required=False)
+    price = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if data['op'] == 'create':
+            required = ['side', 'item', 'count', 'price']
+        else:
+            required = ['listing']
+        missing = [field for field in required if field not in data]
+        if missing:
+            raise serializers.ValidationError({field: 'This field is required.' for field in missing})
+        return data
+
+
+class OrderBatchRequestSerializer(serializers.ListSerializer):
+    MAX_OPERATIONS = 500
+
+    child = OrderOperationSerializer()
+
+    def validate(self, data):
+        if len(data) > self.MAX_OPERATIONS:
+            raise serializers.ValidationError(f'At most {self.MAX_OPERATIONS} operations per batch')
+        return data
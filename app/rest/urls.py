@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from . import views
+from . import async_views, views
 
 router = routers.DefaultRouter()
 router.register('items', views.ItemViewSet)
@@ -11,9 +11,20 @@ app_name = 'api'
 urlpatterns = [
     path('dashboard', views.dashboard, name='dashboard'),
     path('inventory/<int:pk>/sell', views.inventory_sell, name='inventory_sell'),
+    path('inventory/<int:pk>/market-sell', views.inventory_market_sell, name='inventory_market_sell'),
     path('listing/<int:pk>/cancel', views.listing_cancel, name='listing_cancel'),
     path('item/<int:pk>/listings', views.item_listings, name='item_listings'),
+    path('item/<int:pk>/depth', views.item_depth, name='item_depth'),
+    path('item/<int:pk>/candles', views.item_candles, name='item_candles'),
     path('item/<int:pk>/create-listing', views.item_create_buy_listing, name='item_create_buy_listing'),
     path('item/<int:pk>/buy', views.item_buy, name='item_buy'),
+    path('orders/batch', views.orders_batch, name='orders_batch'),
+    path('order/<int:pk>', async_views.order_detail, name='order_detail'),
+    path('async/dashboard', async_views.dashboard, name='async_dashboard'),
+    path('async/item/<int:pk>/listings', async_views.item_listings, name='async_item_listings'),
+    path('async/items/', async_views.item_list, name='async_item_list'),
+    path('async/items/<int:pk>/', async_views.item_detail, name='async_item_detail'),
+    path('async/inventory/', async_views.inventory_list, name='async_inventory_list'),
+    path('async/inventory/<int:pk>/', async_views.inventory_detail, name='async_inventory_detail'),
     path('', include(router.urls)),
 ]
@@ -1,25 +1,77 @@
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 
+from app.book_cache import get_book_snapshot
+from app.rest.pagination import KeysetPagination, get_page_size, keyset_page
 from app.rest.permissions import IsOwner
 from app.rest.serializers import *
 
 
+def book_etag(request, pk):
+    book_version = Item.objects.filter(pk=pk).values_list('book_version', flat=True).first()
+    return None if book_version is None else f'book-{pk}-{book_version}'
+
+
+def catalogue_etag(request):
+    catalogue = Item.objects.aggregate(count=Count('pk'), updated_at=Max('updated_at'))
+    updated_at = catalogue['updated_at'].timestamp() if catalogue['updated_at'] else None
+    return f'items-{catalogue["count"]}-{updated_at}'
+
+
+def item_etag(request, pk):
+    updated_at = Item.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return None if updated_at is None else f'item-{pk}-{updated_at.timestamp()}'
+
+
+def listing_order_result(result):
+    listing = result['listing']
+    return {**result, 'listing': ListingSerializer(listing).data if listing else None}
+
+
+def queued_order(user, item, kind, count, price=None):
+    order = Order.objects.create(user=user, item=item, kind=kind, count=count, price=price)
+    return Response(OrderSerializer(order).data, status=status.HTTP_202_ACCEPTED)
+
+
+def paginated(name, rows, build, params):
+    page, next_cursor = keyset_page(rows, params.get(f'{name}Cursor'), get_page_size(params))
+    return {name: [build(row) for row in page], f'{name}Cursor': next_cursor}
+
+
+def dashboard_data(user, params):
+    sell_listings = Listing.objects.filter(submitter=user, direction=Listing.Direction.SELL).order_by('-pk')
+    buy_listings = Listing.objects.filter(submitter=user, direction=Listing.Direction.BUY).order_by('-pk')
+    inventory_items = InventoryItem.objects.filter(user=user).order_by('pk')
+    return {
+        'user': user.username,
+        'wallet': WalletSerializer(Wallet.get_users_wallet(user)).data,
+        **paginated('sellListings', sell_listings.values(*LISTING_VALUES), listing_data, params),
+        **paginated('buyListings', buy_listings.values(*LISTING_VALUES), listing_data, params),
+        **paginated('inventory', inventory_items.values(*INVENTORY_ITEM_VALUES), inventory_item_data, params),
+    }
+
+
+def item_listings_data(item, params):
+    page_key = ':'.join(str(params.get(name)) for name in ['buyListingsCursor', 'sellListingsCursor', 'page_size'])
+    return get_book_snapshot(item, f'listings:{page_key}', lambda: {
+        **paginated('buyListings', Listing.objects.buy_side(item).values(*LISTING_VALUES), listing_data, params),
+        **paginated('sellListings', Listing.objects.sell_side(item).values(*LISTING_VALUES), listing_data, params),
+    })
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def dashboard(request):
-    sell_listings = Listing.objects.filter(submitter=request.user, direction=Listing.Direction.SELL).order_by('-pk')
-    buy_listings = Listing.objects.filter(submitter=request.user, direction=Listing.Direction.BUY).order_by('-pk')
-    inventory_items = InventoryItem.objects.filter(user=request.user)
-    return Response({
-        'user': request.user.username,
-        'wallet': WalletSerializer(Wallet.get_users_wallet(request.user)).data,
-        'sellListings': ListingSerializer(sell_listings, many=True).data,
-        'buyListings': ListingSerializer(buy_listings, many=True).data,
-        'inventory': InventoryItemSerializer(inventory_items, many=True).data,
-    })
+    return Response(dashboard_data(request.user, request.query_params))
 
 
 @api_view(['POST'])
@@ -28,16 +80,36 @@ def inventory_sell(request, pk):
     inventory_item = get_object_or_404(InventoryItem, pk=pk, user=request.user)
     serializer = ListingRequestSerializer(data=request.data)
     if serializer.is_valid():
+        if settings.ORDER_QUEUE:
+            return queued_order(request.user, inventory_item.item, Order.Kind.SELL_LISTING, serializer.data['count'],
+                                serializer.data['price'])
         try:
-            listing = inventory_item.make_sell_listing(serializer.data['count'],
-                                                       serializer.data['price'])
-            return Response(ListingSerializer(listing).data)
+            result = inventory_item.make_sell_listing(serializer.data['count'],
+                                                      serializer.data['price'])
+            return Response(listing_order_result(result))
         except FailedToCreateListingError as e:
             return Response({'error': e.msg}, status=status.HTTP_400_BAD_REQUEST)
     else:
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def inventory_market_sell(request, pk):
+    inventory_item = get_object_or_404(InventoryItem, pk=pk, user=request.user)
+    serializer = InventoryMarketSellRequestSerializer(data=request.data)
+    if serializer.is_valid():
+        if settings.ORDER_QUEUE:
+            return queued_order(request.user, inventory_item.item, Order.Kind.SELL, serializer.data['count'])
+        try:
+            result = inventory_item.make_sell_transaction(serializer.data['count'])
+            return Response(result)
+        except FailedToMakeTransactionError as e:
+            return Response({'error': e.msg}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def listing_cancel(request, pk):
@@ -47,13 +119,44 @@ def listing_cancel(request, pk):
 
 
 @api_view(['GET'])
+@condition(etag_func=book_etag)
 def item_listings(request, pk):
     item = get_object_or_404(Item, pk=pk)
+    return Response(item_listings_data(item, request.query_params))
+
+
+@api_view(['GET'])
+@condition(etag_func=book_etag)
+def item_depth(request, pk):
+    item = get_object_or_404(Item, pk=pk)
+    serializer = DepthRequestSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    depth = serializer.validated_data['depth']
+    return Response(get_book_snapshot(item, f'depth-{depth}', lambda: {
+        'buyLevels': PriceLevelSerializer(Listing.objects.buy_side(item).levels()[:depth], many=True).data,
+        'sellLevels': PriceLevelSerializer(Listing.objects.sell_side(item).levels()[:depth], many=True).data,
+    }))
+
+
+@api_view(['GET'])
+@condition(etag_func=book_etag)
+def item_candles(request, pk):
+    item = get_object_or_404(Item, pk=pk)
+    serializer = CandleRequestSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    interval = serializer.validated_data['interval']
+    candles = Candle.objects.filter(item=item, interval=interval)
+    if 'start' in serializer.validated_data:
+        candles = candles.filter(start__gte=Candle.bucket_start(serializer.validated_data['start'], interval))
+    if 'end' in serializer.validated_data:
+        candles = candles.filter(start__lt=serializer.validated_data['end'])
+    # The most recent candles of the range, oldest first
+    rows = candles.order_by('-start').values(*CANDLE_VALUES)[:CandleRequestSerializer.MAX_CANDLES]
     return Response({
-        'buyListings': ListingSerializer(
-            Listing.objects.filter(item=item, direction=Listing.Direction.BUY).order_by('-price'), many=True).data,
-        'sellListings': ListingSerializer(
-            Listing.objects.filter(item=item, direction=Listing.Direction.SELL).order_by('price'), many=True).data,
+        'interval': Candle.Interval(interval).label,
+        'candles': [candle_data(row) for row in reversed(rows)],
     })
 
 
@@ -63,11 +166,14 @@ def item_create_buy_listing(request, pk):
     item = get_object_or_404(Item, pk=pk)
     serializer = ListingRequestSerializer(data=request.data)
     if serializer.is_valid():
+        if settings.ORDER_QUEUE:
+            return queued_order(request.user, item, Order.Kind.BUY_LISTING, serializer.data['count'],
+                                serializer.data['price'])
         try:
-            listing = item.make_buy_listing(request.user,
-                                            count=serializer.data['count'],
-                                            price=serializer.data['price'])
-            return Response(ListingSerializer(listing).data)
+            result = item.make_buy_listing(request.user,
+                                           count=serializer.data['count'],
+                                           price=serializer.data['price'])
+            return Response(listing_order_result(result))
         except FailedToCreateListingError as e:
             return Response({'error': e.msg}, status=status.HTTP_400_BAD_REQUEST)
     else:
@@ -80,6 +186,8 @@ def item_buy(request, pk):
     item = get_object_or_404(Item, pk=pk)
     serializer = ItemBuyRequestSerializer(data=request.data)
     if serializer.is_valid():
+        if settings.ORDER_QUEUE:
+            return queued_order(request.user, item, Order.Kind.BUY, serializer.data['count'])
         try:
             result = item.make_buy_transaction(request.user, serializer.data['count'])
             return Response(result)
@@ -89,14 +197,96 @@ def item_buy(request, pk):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def orders_batch(request):
+    serializer = OrderBatchRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    results = []
+    with transaction.atomic():
+        # The batch holds every book it touches until it commits, so it takes them all up front in the one lock order
+        Item.lock_books(batch_item_ids(request.user, serializer.validated_data))
+        # Consecutive cancels are applied together with one refund pass and one bulk delete
+        for is_cancel, operations in groupby(serializer.validated_data, key=is_cancel_operation):
+            if is_cancel:
+                results.extend(cancel_orders(request.user, list(operations)))
+            else:
+                results.extend(execute_order(request.user, operation) for operation in operations)
+    return Response({'results': results})
+
+
+def is_cancel_operation(operation):
+    return operation['op'] == 'cancel'
+
+
+def batch_item_ids(user, operations):
+    item_ids = {operation['item'] for operation in operations if operation['op'] == 'create'}
+    listing_ids = [operation['listing'] for operation in operations if operation['op'] != 'create']
+    item_ids.update(Listing.objects.filter(submitter=user, pk__in=listing_ids).values_list('item_id', flat=True))
+    return item_ids
+
+
+def cancel_orders(user, operations):
+    listings = Listing.objects.filter(submitter=user, pk__in=[operation['listing'] for operation in operations])
+    cancelled = {listing.pk for listing in listings.cancel()}
+    results = []
+    for operation in operations:
+        if operation['listing'] in cancelled:
+            cancelled.remove(operation['listing'])
+            results.append({'status': 'ok', 'listing': operation['listing']})
+        else:
+            results.append({'status': 'error', 'error': 'Listing not found'})
+    return results
+
+
+def execute_order(user, operation):
+    try:
+        with transaction.atomic():
+            if operation['op'] == 'amend':
+                cancelled = Listing.objects.filter(pk=operation['listing'], submitter=user).cancel()
+                if not cancelled:
+                    raise FailedToCreateListingError('Listing not found')
+                listing = cancelled[0]
+                side = 'buy' if listing.direction == Listing.Direction.BUY else 'sell'
+                item_id = listing.item_id
+                count = operation.get('count', listing.count)
+                price = operation.get('price', listing.price)
+            else:
+                side, item_id = operation['side'], operation['item']
+                count, price = operation['count'], operation['price']
+            result = create_order(user, side, item_id, count, price)
+    except FailedToCreateListingError as e:
+        return {'status': 'error', 'error': e.msg}
+    return {'status': 'ok', **listing_order_result(result)}
+
+
+def create_order(user, side, item_id, count, price):
+    if side == 'buy':
+        try:
+            item = Item.objects.get(pk=item_id)
+        except Item.DoesNotExist:
+            raise FailedToCreateListingError('Item not found')
+        return item.make_buy_listing(user, count=count, price=price)
+    try:
+        inventory_item = InventoryItem.objects.get(user=user, item_id=item_id)
+    except InventoryItem.DoesNotExist:
+        raise FailedToCreateListingError('User does not have enough items')
+    return inventory_item.make_sell_listing(count, price)
+
+
+@method_decorator(condition(etag_func=catalogue_etag), name='list')
+@method_decorator(condition(etag_func=item_etag), name='retrieve')
 class ItemViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Item.objects.all()
+    queryset = Item.objects.order_by('pk')
     serializer_class = ItemSerializer
+    pagination_class = KeysetPagination
 
 
 class InventoryItemViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = InventoryItemSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwner]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return InventoryItem.objects.filter(user=self.request.user)
+        return InventoryItem.objects.filter(user=self.request.user).select_related('item').order_by('pk')
@@ -0,0 +1,83 @@
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+from app.models import Item, InventoryItem, Wallet
+from auction_house.asgi import application
+
+
+class BookStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.seller = User.objects.create_user(username='jon', password='abc')
+        Wallet.get_users_wallet(self.user).add(1000)
+        self.inventory_item = InventoryItem.objects.create(user=self.seller, item=self.item, count=20)
+
+    def connect(self, pk):
+        return WebsocketCommunicator(application, f'/ws/v1/item/{pk}/book', headers=[(b'origin', b'http://testserver')])
+
+    def test_unknown_item(self):
+        @async_to_sync
+        async def scenario():
+            communicator = self.connect(self.item.pk + 1)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            output = await communicator.receive_output()
+            self.assertEqual('websocket.close', output['type'])
+            self.assertEqual(4404, output['code'])
+
+        scenario()
+
+    def test_snapshot_then_changes(self):
+        self.inventory_item.make_sell_listing(count=5, price=20)
+
+        @async_to_sync
+        async def scenario():
+            communicator = self.connect(self.item.pk)
+            await communicator.connect()
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual('snapshot', snapshot['type'])
+            self.assertEqual(1, snapshot['seq'])
+            self.assertEqual(1, snapshot['version'])
+            self.assertEqual([{'price': 20, 'total_count': 5, 'order_count': 1}], snapshot['sellLevels'])
+            self.assertEqual([], snapshot['buyLevels'])
+
+            await database_sync_to_async(self.item.make_buy_listing)(self.user, count=2, price=10)
+            self.assertEqual({
+                'seq': 2, 'type': 'level', 'action': 'added', 'version': 2,
+                'side': 'buy', 'price': 10, 'total_count': 2, 'order_count': 1,
+            }, await communicator.receive_json_from())
+
+            await database_sync_to_async(self.item.make_buy_transaction)(self.user, count=5)
+            self.assertEqual({
+                'seq': 3, 'type': 'level', 'action': 'removed', 'version': 3,
+                'side': 'sell', 'price': 20, 'total_count': 0, 'order_count': 0,
+            }, await communicator.receive_json_from())
+            self.assertEqual({
+                'seq': 4, 'type': 'trade', 'version': 3, 'side': 'buy', 'price': 20, 'count': 5,
+            }, await communicator.receive_json_from())
+
+            await communicator.disconnect()
+
+        scenario()
+
+    def test_missed_change_sends_new_snapshot(self):
+        @async_to_sync
+        async def scenario():
+            communicator = self.connect(self.item.pk)
+            await communicator.connect()
+            await communicator.receive_json_from()
+
+            await database_sync_to_async(Item.bump_book_versions)([self.item.pk])
+            await database_sync_to_async(self.inventory_item.make_sell_listing)(count=5, price=20)
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual('snapshot', snapshot['type'])
+            self.assertEqual(2, snapshot['version'])
+            self.assertEqual([{'price': 20, 'total_count': 5, 'order_count': 1}], snapshot['sellLevels'])
+
+            await communicator.disconnect()
+
+        scenario()
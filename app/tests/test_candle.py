@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from app.models import Candle, Item, Listing, Trade, Wallet
+
+
+class CandleTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+
+    def trade(self, price, count, minute, second=0):
+        timestamp = datetime(2020, 3, 1, 10, minute, second, tzinfo=timezone.utc)
+        return Trade(item=self.item, price=price, count=count, timestamp=timestamp)
+
+    def candle(self, interval, minute=0):
+        start = datetime(2020, 3, 1, 10, minute, tzinfo=timezone.utc)
+        return Candle.objects.get(item=self.item, interval=interval, start=start)
+
+    def test_trades_rolled_up_into_every_interval(self):
+        Candle.add_trades([self.trade(10, 2, 0), self.trade(14, 1, 0, 30), self.trade(8, 1, 1)])
+        minute = self.candle(Candle.Interval.MINUTE)
+        self.assertEqual((10, 14, 10, 14, 3), (minute.open, minute.high, minute.low, minute.close, minute.volume))
+        self.assertEqual(8, self.candle(Candle.Interval.MINUTE, minute=1).close)
+        for interval in [Candle.Interval.FIVE_MINUTES, Candle.Interval.HOUR]:
+            candle = self.candle(interval)
+            self.assertEqual((10, 14, 8, 8, 4), (candle.open, candle.high, candle.low, candle.close, candle.volume))
+            self.assertEqual(42 / 4, candle.vwap)
+        self.assertEqual(1, Candle.objects.filter(interval=Candle.Interval.DAY).count())
+
+    def test_later_batches_merge_into_existing_candles(self):
+        Candle.add_trades([self.trade(10, 1, 0)])
+        Candle.add_trades([self.trade(6, 3, 0, 10)])
+        Candle.add_trades([self.trade(12, 1, 0, 20)])
+        candle = self.candle(Candle.Interval.MINUTE)
+        self.assertEqual((10, 12, 6, 12, 5), (candle.open, candle.high, candle.low, candle.close, candle.volume))
+        self.assertEqual(40, candle.turnover)
+        self.assertEqual(4, Candle.objects.count())
+
+    def test_batch_query_count_does_not_depend_on_trades(self):
+        Candle.add_trades([self.trade(10, 1, 0)])
+        with self.assertNumQueries(3):
+            Candle.add_trades([self.trade(10 + i, 1, i % 10) for i in range(50)])
+
+    def test_settlement_updates_candles(self):
+        user = User.objects.create_user(username='ben', password='abc')
+        seller = User.objects.create_user(username='jon', password='abc')
+        Listing.objects.create(item=self.item, count=2, price=10, direction=Listing.Direction.SELL, submitter=seller)
+        Listing.objects.create(item=self.item, count=2, price=20, direction=Listing.Direction.SELL, submitter=seller)
+        Wallet.get_users_wallet(user).add(100)
+        self.item.make_buy_transaction(user, count=3)
+        candle = Candle.objects.get(interval=Candle.Interval.MINUTE)
+        self.assertEqual((10, 20, 10, 20, 3), (candle.open, candle.high, candle.low, candle.close, candle.volume))
@@ -0,0 +1,76 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from app.errors import FailedToMakeTransactionError
+from app.models import Item, Listing, Wallet, InventoryItem
+
+
+class InventorySellTransactionTests(TestCase):
+    def setUp(self) -> None:
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.buyer = User.objects.create_user(username='jon', password='abc')
+        self.inventory_item = InventoryItem.objects.create(user=self.user, item=self.item, count=20)
+
+    def test_no_listings(self):
+        Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                               submitter=self.buyer)
+        with self.assertRaises(FailedToMakeTransactionError) as cm:
+            self.inventory_item.make_sell_transaction(count=5)
+        self.assertEqual(cm.exception.msg, 'No listings')
+
+    def test_not_enough_items(self):
+        with self.assertRaises(FailedToMakeTransactionError) as cm:
+            self.inventory_item.make_sell_transaction(count=25)
+        self.assertEqual(cm.exception.msg, 'User does not have enough items')
+
+    def test_success_listing_remains(self):
+        Listing.objects.create(item=self.item, count=20, price=10, direction=Listing.Direction.BUY,
+                               submitter=self.buyer)
+
+        result = self.inventory_item.make_sell_transaction(count=5)
+        self.assertEqual(5, result['items_sold'])
+        self.assertEqual(50, result['coins_earned'])
+
+        self.assertEqual(50, Wallet.get_users_wallet(self.user).coins)
+        self.assertEqual(0, Wallet.get_users_wallet(self.buyer).coins)
+        self.assertEqual(15, InventoryItem.objects.get(user=self.user, item=self.item).count)
+        self.assertEqual(5, InventoryItem.objects.get(user=self.buyer, item=self.item).count)
+        self.assertEqual(15, Listing.objects.get(item=self.item).count)
+
+    def test_success_highest_price_first(self):
+        other_buyer = User.objects.create_user(username='tom', password='abc')
+        Listing.objects.create(item=self.item, count=10, price=10, direction=Listing.Direction.BUY,
+                               submitter=self.buyer)
+        Listing.objects.create(item=self.item, count=10, price=20, direction=Listing.Direction.BUY,
+                               submitter=other_buyer)
+
+        result = self.inventory_item.make_sell_transaction(count=15)
+        self.assertEqual(15, result['items_sold'])
+        self.assertEqual(200 + 50, result['coins_earned'])
+
+        self.assertEqual(250, Wallet.get_users_wallet(self.user).coins)
+        self.assertEqual(5, InventoryItem.objects.get(user=self.user, item=self.item).count)
+        self.assertEqual(5, InventoryItem.objects.get(user=self.buyer, item=self.item).count)
+        self.assertEqual(10, InventoryItem.objects.get(user=other_buyer, item=self.item).count)
+        self.assertEqual(1, Listing.objects.filter(item=self.item).count())
+        self.assertEqual(5, Listing.objects.get(item=self.item).count)
+
+    def test_partial_success_not_enough_listings(self):
+        Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.BUY,
+                               submitter=self.buyer)
+
+        result = self.inventory_item.make_sell_transaction(count=10)
+        self.assertEqual(5, result['items_sold'])
+        self.assertEqual(50, result['coins_earned'])
+
+        self.assertEqual(15, InventoryItem.objects.get(user=self.user, item=self.item).count)
+        self.assertFalse(Listing.objects.filter(item=self.item).exists())
+
+    def test_selling_to_own_buy_listing(self):
+        Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.BUY,
+                               submitter=self.user)
+
+        result = self.inventory_item.make_sell_transaction(count=5)
+        self.assertEqual(5, result['items_sold'])
+        self.assertEqual(20, InventoryItem.objects.get(user=self.user, item=self.item).count)
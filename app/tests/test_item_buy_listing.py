@@ -12,27 +12,73 @@ class BuyListingTests(TestCase):
             item.make_buy_listing(user, count=5, price=20)
         self.assertEqual(cm.exception.msg, 'User does not have enough money')
 
-    def test_sell_price_is_lower(self):
+    def test_crossing_listing_fills_at_resting_price(self):
         item = Item.objects.create(name='sword')
         user = User.objects.create_user(username='ben', password='abc')
-        wallet = Wallet.get_users_wallet(user)
-        wallet.coins = 20
-        wallet.save()
-        InventoryItem.objects.create(user=user, item=item, count=5)
-        Listing.objects.create(item=item, count=5, price=10, direction=Listing.Direction.SELL, submitter=user)
+        seller = User.objects.create_user(username='jon', password='abc')
+        Wallet.get_users_wallet(user).add(100)
+        Listing.objects.create(item=item, count=3, price=10, direction=Listing.Direction.SELL, submitter=seller)
+        Listing.objects.create(item=item, count=5, price=15, direction=Listing.Direction.SELL, submitter=seller)
+        Listing.objects.create(item=item, count=5, price=25, direction=Listing.Direction.SELL, submitter=seller)
+
+        result = item.make_buy_listing(user, count=5, price=20)
+        self.assertIsNone(result['listing'])
+        self.assertEqual(5, result['items_purchased'])
+        self.assertEqual(30 + 30, result['coins_spent'])
+
+        self.assertEqual(40, Wallet.get_users_wallet(user).coins)
+        self.assertEqual(60, Wallet.get_users_wallet(seller).coins)
+        self.assertEqual(5, InventoryItem.objects.get(user=user, item=item).count)
+        self.assertEqual([(15, 3), (25, 5)], list(Listing.objects.sell_side(item).values_list('price', 'count')))
+        self.assertFalse(Listing.objects.filter(direction=Listing.Direction.BUY).exists())
+
+    def test_crossing_listing_rests_remainder(self):
+        item = Item.objects.create(name='sword')
+        user = User.objects.create_user(username='ben', password='abc')
+        seller = User.objects.create_user(username='jon', password='abc')
+        Wallet.get_users_wallet(user).add(100)
+        Listing.objects.create(item=item, count=2, price=10, direction=Listing.Direction.SELL, submitter=seller)
+
+        result = item.make_buy_listing(user, count=5, price=20)
+        self.assertEqual(2, result['items_purchased'])
+        self.assertEqual(20, result['coins_spent'])
+        self.assertEqual(3, result['listing'].count)
+        self.assertEqual(20, result['listing'].price)
+
+        self.assertEqual(100 - 20 - 3 * 20, Wallet.get_users_wallet(user).coins)
+        self.assertEqual(20, Wallet.get_users_wallet(seller).coins)
+        self.assertFalse(Listing.objects.sell_side(item).exists())
+
+    def test_crossing_listing_not_affordable(self):
+        item = Item.objects.create(name='sword')
+        user = User.objects.create_user(username='ben', password='abc')
+        seller = User.objects.create_user(username='jon', password='abc')
+        Wallet.get_users_wallet(user).add(50)
+        Listing.objects.create(item=item, count=2, price=10, direction=Listing.Direction.SELL, submitter=seller)
 
         with self.assertRaises(FailedToCreateListingError) as cm:
             item.make_buy_listing(user, count=5, price=20)
-        self.assertEqual(cm.exception.msg, 'Cannot make listing when buy price is higher than lowest sell listing')
+        self.assertEqual(cm.exception.msg, 'User does not have enough money')
+        self.assertEqual(50, Wallet.get_users_wallet(user).coins)
+        self.assertEqual(2, Listing.objects.get().count)
+
+    def test_invalid_count(self):
+        item = Item.objects.create(name='sword')
+        user = User.objects.create_user(username='ben', password='abc')
+
+        with self.assertRaises(FailedToCreateListingError) as cm:
+            item.make_buy_listing(user, count=-5, price=20)
+        self.assertEqual(cm.exception.msg, 'Count and price must be positive')
 
     def test_successful_listing(self):
         item = Item.objects.create(name='sword')
         user = User.objects.create_user(username='ben', password='abc')
         wallet = Wallet.get_users_wallet(user)
-        wallet.coins = 20
+        wallet.coins = 60
         wallet.save()
 
-        item.make_buy_listing(user, count=5, price=10)
+        result = item.make_buy_listing(user, count=5, price=10)
+        self.assertEqual(0, result['items_purchased'])
 
         listings = list(Listing.objects.all())
         self.assertEqual(1, len(listings))
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from app.errors import FailedToMakeTransactionError
 from app.models import Item, Listing, Wallet, InventoryItem
@@ -16,6 +18,15 @@ class ItemBuyTransactionTests(TestCase):
             self.item.make_buy_transaction(self.user, count=5)
         self.assertEqual(cm.exception.msg, 'No listings')
 
+    def test_count_must_be_positive(self):
+        listing = Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                                         submitter=self.seller)
+        for count in [0, -3]:
+            with self.assertRaises(FailedToMakeTransactionError) as cm:
+                self.item.make_buy_transaction(self.user, count=count)
+            self.assertEqual(cm.exception.msg, 'Count must be positive')
+        self.assertEqual(5, Listing.objects.get(pk=listing.pk).count)
+
     def test_user_has_no_coins(self):
         listing = Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
                                          submitter=self.seller)
@@ -112,4 +123,51 @@ class ItemBuyTransactionTests(TestCase):
         self.assertEqual(200, Wallet.get_users_wallet(self.user).coins)
         self.assertEqual(600, Wallet.get_users_wallet(self.seller).coins)
         self.assertEqual(40, InventoryItem.objects.get(user=self.user, item=self.item).count)
-        self.assertEqual(0, Listing.objects.filter(item=self.item).count())
\ No newline at end of file
+        self.assertEqual(0, Listing.objects.filter(item=self.item).count())
+
+    def test_equal_prices_filled_in_submission_order(self):
+        first = Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                                       submitter=self.seller)
+        second = Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                                        submitter=self.seller)
+        Wallet.get_users_wallet(self.user).add(30)
+
+        result = self.item.make_buy_transaction(self.user, count=3)
+        self.assertEquals(3, result['items_purchased'])
+
+        self.assertEqual(2, Listing.objects.get(pk=first.pk).count)
+        self.assertEqual(5, Listing.objects.get(pk=second.pk).count)
+
+    def test_multiple_sellers_credited(self):
+        other_seller = User.objects.create_user(username='tom', password='abc')
+        Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                               submitter=self.seller)
+        Listing.objects.create(item=self.item, count=5, price=20, direction=Listing.Direction.SELL,
+                               submitter=other_seller)
+        Listing.objects.create(item=self.item, count=5, price=30, direction=Listing.Direction.SELL,
+                               submitter=self.seller)
+        Wallet.get_users_wallet(self.user).add(1000)
+
+        result = self.item.make_buy_transaction(self.user, count=12)
+        self.assertEquals(12, result['items_purchased'])
+        self.assertEquals(50 + 100 + 60, result['coins_spent'])
+
+        self.assertEqual(1000 - 210, Wallet.get_users_wallet(self.user).coins)
+        self.assertEqual(50 + 60, Wallet.get_users_wallet(self.seller).coins)
+        self.assertEqual(100, Wallet.get_users_wallet(other_seller).coins)
+        self.assertEqual(3, Listing.objects.get(item=self.item).count)
+
+    def count_sweep_queries(self, listing_count):
+        sellers = [self.seller, User.objects.create_user(username=f'seller-{listing_count}', password='abc')]
+        for i in range(listing_count):
+            Listing.objects.create(item=self.item, count=2, price=10, direction=Listing.Direction.SELL,
+                                   submitter=sellers[i % 2])
+        Wallet.get_users_wallet(self.user).add(10000)
+        with CaptureQueriesContext(connection) as queries:
+            result = self.item.make_buy_transaction(self.user, count=listing_count * 2 - 1)
+        self.assertEqual(listing_count * 2 - 1, result['items_purchased'])
+        Listing.objects.all().delete()
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_swept_listings(self):
+        self.assertEqual(self.count_sweep_queries(2), self.count_sweep_queries(50))
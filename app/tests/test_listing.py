@@ -35,6 +35,34 @@ class ListingTests(TestCase):
         listing.process_purchase(5)
         self.assertEqual(0, Listing.objects.all().count())
 
+    def test_process_purchase_from_stale_instance(self):
+        listing = Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                                         submitter=self.user)
+        stale_listing = Listing.objects.get(pk=listing.pk)
+        listing.process_purchase(5)
+        with self.assertRaises(ValueError):
+            stale_listing.process_purchase(2)
+        self.assertFalse(Listing.objects.exists())
+        self.assertEqual(50, Wallet.get_users_wallet(self.user).coins)
+
+    def test_process_purchase_partial_from_stale_instance(self):
+        listing = Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                                         submitter=self.user)
+        stale_listing = Listing.objects.get(pk=listing.pk)
+        listing.process_purchase(3)
+        with self.assertRaises(ValueError):
+            stale_listing.process_purchase(3)
+        stale_listing.process_purchase(2)
+        self.assertFalse(Listing.objects.exists())
+        self.assertEqual(50, Wallet.get_users_wallet(self.user).coins)
+
+    def test_process_purchase_bumps_book_version(self):
+        listing = Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                                         submitter=self.user)
+        listing.process_purchase(1)
+        self.item.refresh_from_db()
+        self.assertEqual(1, self.item.book_version)
+
 
 class CancelListingTests(TestCase):
     def setUp(self):
@@ -56,3 +84,57 @@ class CancelListingTests(TestCase):
         self.assertEqual(0, Listing.objects.count())
         self.assertEqual(0, Wallet.get_users_wallet(self.user).coins)
         self.assertEqual(5, InventoryItem.objects.get(user=self.user, item=self.item).count)
+
+    def test_cancel_bumps_book_version(self):
+        listing = Listing.objects.create(item=self.item, count=5, price=10, submitter=self.user,
+                                         direction=Listing.Direction.SELL)
+        listing.cancel()
+        self.item.refresh_from_db()
+        self.assertEqual(1, self.item.book_version)
+
+
+class ListingQuerySetTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.other_item = Item.objects.create(name='shield')
+        self.user = User.objects.create_user(username='ben', password='abc')
+
+    def create_listing(self, item, price, direction):
+        return Listing.objects.create(item=item, count=1, price=price, direction=direction, submitter=self.user)
+
+    def test_sell_side_price_time_priority(self):
+        expensive = self.create_listing(self.item, 20, Listing.Direction.SELL)
+        cheap = self.create_listing(self.item, 10, Listing.Direction.SELL)
+        cheap_later = self.create_listing(self.item, 10, Listing.Direction.SELL)
+        self.create_listing(self.item, 5, Listing.Direction.BUY)
+        self.create_listing(self.other_item, 1, Listing.Direction.SELL)
+        self.assertEqual([cheap, cheap_later, expensive], list(Listing.objects.sell_side(self.item)))
+
+    def test_buy_side_price_time_priority(self):
+        low = self.create_listing(self.item, 10, Listing.Direction.BUY)
+        high = self.create_listing(self.item, 20, Listing.Direction.BUY)
+        high_later = self.create_listing(self.item, 20, Listing.Direction.BUY)
+        self.create_listing(self.item, 30, Listing.Direction.SELL)
+        self.assertEqual([high, high_later, low], list(Listing.objects.buy_side(self.item)))
+
+    def test_best_price(self):
+        self.assertIsNone(Listing.objects.sell_side(self.item).best_price())
+        self.create_listing(self.item, 20, Listing.Direction.SELL)
+        self.create_listing(self.item, 10, Listing.Direction.SELL)
+        self.create_listing(self.item, 5, Listing.Direction.BUY)
+        self.create_listing(self.item, 8, Listing.Direction.BUY)
+        self.assertEqual(10, Listing.objects.sell_side(self.item).best_price())
+        self.assertEqual(8, Listing.objects.buy_side(self.item).best_price())
+
+    def test_levels(self):
+        self.create_listing(self.item, 10, Listing.Direction.SELL)
+        Listing.objects.create(item=self.item, count=4, price=10, direction=Listing.Direction.SELL,
+                               submitter=self.user)
+        self.create_listing(self.item, 20, Listing.Direction.SELL)
+        self.create_listing(self.item, 5, Listing.Direction.BUY)
+        self.create_listing(self.item, 8, Listing.Direction.BUY)
+        self.assertEqual([
+            {'price': 10, 'total_count': 5, 'order_count': 2},
+            {'price': 20, 'total_count': 1, 'order_count': 1},
+        ], list(Listing.objects.sell_side(self.item).levels()))
+        self.assertEqual([8, 5], [level['price'] for level in Listing.objects.buy_side(self.item).levels()])
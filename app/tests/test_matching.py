@@ -0,0 +1,142 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import DataError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from app.matching import MAX_ATTEMPTS, execute, order_result, process_pending
+from app.models import InventoryItem, Item, Listing, Order, Wallet
+
+
+class MatcherTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.seller = User.objects.create_user(username='jon', password='abc')
+
+    def test_buy_order(self):
+        Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                               submitter=self.seller)
+        Wallet.get_users_wallet(self.user).add(50)
+        order = Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.BUY, count=3)
+        self.assertEqual(1, process_pending(0, 1, batch_size=10))
+        order.refresh_from_db()
+        self.assertEqual(Order.Status.DONE, order.status)
+        self.assertEqual({'items_purchased': 3, 'coins_spent': 30}, order.result)
+        self.assertIsNotNone(order.processed_at)
+        self.assertEqual(3, InventoryItem.objects.get(user=self.user).count)
+
+    def test_listing_orders(self):
+        InventoryItem.objects.create(user=self.seller, item=self.item, count=5)
+        Wallet.get_users_wallet(self.user).add(50)
+        sell = Order.objects.create(user=self.seller, item=self.item, kind=Order.Kind.SELL_LISTING, count=5, price=10)
+        buy = Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.BUY_LISTING, count=2, price=10)
+        process_pending(0, 1, batch_size=10)
+        sell.refresh_from_db()
+        buy.refresh_from_db()
+        self.assertEqual(5, sell.result['listing']['count'])
+        self.assertEqual((None, 2), (buy.result['listing'], buy.result['items_purchased']))
+        self.assertEqual(3, Listing.objects.get().count)
+
+    def test_failed_order(self):
+        order = Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.SELL, count=3)
+        process_pending(0, 1, batch_size=10)
+        order.refresh_from_db()
+        self.assertEqual((Order.Status.FAILED, 'User does not have enough items'), (order.status, order.error))
+        self.assertIsNone(order.result)
+
+    def test_processed_order_not_run_again(self):
+        Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                               submitter=self.seller)
+        Wallet.get_users_wallet(self.user).add(50)
+        order = Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.BUY, count=3)
+        stale_order = Order.objects.get(pk=order.pk)
+        process_pending(0, 1, batch_size=10)
+        # What a second worker serving the same partition would do with the order it read before the first finished
+        execute(stale_order)
+        self.assertEqual(3, InventoryItem.objects.get(user=self.user).count)
+        self.assertEqual(20, Wallet.get_users_wallet(self.user).coins)
+
+    def test_erroring_order_failed_after_max_attempts(self):
+        Wallet.get_users_wallet(self.user).add(50)
+        Listing.objects.create(item=self.item, count=5, price=10, direction=Listing.Direction.SELL,
+                               submitter=self.seller)
+        broken = Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.BUY, count=1)
+        other = Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.BUY, count=1)
+
+        def result(order):
+            if order.pk == broken.pk:
+                raise DataError('integer out of range')
+            return order_result(order)
+
+        with mock.patch('app.matching.order_result', side_effect=result), self.assertLogs('app.matching', 'ERROR'):
+            for _ in range(MAX_ATTEMPTS + 1):
+                process_pending(0, 1, batch_size=10)
+        broken.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((Order.Status.FAILED, MAX_ATTEMPTS), (broken.status, broken.attempts))
+        self.assertEqual(Order.Status.DONE, other.status)
+        self.assertEqual(1, InventoryItem.objects.get(user=self.user).count)
+
+    def test_partitions(self):
+        shield = Item.objects.create(name='shield')
+        Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.BUY, count=1)
+        Order.objects.create(user=self.user, item=shield, kind=Order.Kind.BUY, count=1)
+        self.assertEqual(1, process_pending(shield.pk % 2, 2, batch_size=10))
+        self.assertEqual([self.item], [order.item for order in Order.objects.filter(status=Order.Status.PENDING)])
+        self.assertEqual(0, process_pending(shield.pk % 2, 2, batch_size=10))
+        self.assertEqual(1, process_pending(self.item.pk % 2, 2, batch_size=10))
+
+    def test_orders_processed_in_arrival_order(self):
+        InventoryItem.objects.create(user=self.seller, item=self.item, count=1)
+        Wallet.get_users_wallet(self.user).add(50)
+        Order.objects.create(user=self.seller, item=self.item, kind=Order.Kind.SELL_LISTING, count=1, price=10)
+        second = Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.BUY, count=1)
+        process_pending(0, 1, batch_size=10)
+        second.refresh_from_db()
+        self.assertEqual(1, second.result['items_purchased'])
+
+
+@override_settings(ORDER_QUEUE=True)
+class QueuedOrderViewTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_order_queued_and_awaited(self):
+        response = self.client.post(reverse('api:item_buy', kwargs={'pk': 1}), data={'count': 1})
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(Order.Status.PENDING, response.data['status'])
+        order_url = reverse('api:order_detail', kwargs={'pk': response.data['id']})
+        self.assertEqual(Order.Status.PENDING, self.client.get(order_url, {'wait': 0.1}).json()['status'])
+        process_pending(0, 1, batch_size=10)
+        response = self.client.get(order_url, {'wait': 5})
+        self.assertEqual((Order.Status.FAILED, 'No listings'), (response.json()['status'], response.json()['error']))
+
+    def test_listing_orders_queued(self):
+        InventoryItem.objects.create(user=self.user, item=self.item, count=5)
+        response = self.client.post(reverse('api:inventory_sell', kwargs={'pk': 1}), data={'count': 5, 'price': 10})
+        self.assertEqual((202, Order.Kind.SELL_LISTING), (response.status_code, response.data['kind']))
+        self.assertFalse(Listing.objects.exists())
+
+    def test_order_read_back_over_session(self):
+        order = Order.objects.create(user=self.user, item=self.item, kind=Order.Kind.BUY, count=1)
+        client = APIClient()
+        client.force_login(self.user)
+        response = client.get(reverse('api:order_detail', kwargs={'pk': order.pk}))
+        self.assertEqual((200, Order.Status.PENDING), (response.status_code, response.json()['status']))
+        # Sessions only read, orders still need the token
+        response = client.post(reverse('api:item_buy', kwargs={'pk': 1}), data={'count': 1})
+        self.assertEqual(401, response.status_code)
+
+    def test_other_users_order_not_found(self):
+        other = User.objects.create_user(username='jon', password='abc')
+        order = Order.objects.create(user=other, item=self.item, kind=Order.Kind.BUY, count=1)
+        response = self.client.get(reverse('api:order_detail', kwargs={'pk': order.pk}))
+        self.assertEqual(404, response.status_code)
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TestCase
+from django.urls import reverse
+
+from app.metrics import ORDER_FILLS, ORDER_LEVELS_SWEPT, REQUEST_DB_QUERIES, REQUEST_DURATION, REQUESTS, Counter, \
+    Histogram, QueryStats, Registry
+from app.models import Item, Listing, Wallet
+
+
+class RegistryTests(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_sums_threads(self):
+        counter = Counter('test_total', 'Test counter', registry=self.registry)
+        threads = [threading.Thread(target=lambda: [counter.inc(view='a') for _ in range(100)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(400, counter.value(view='a'))
+        self.assertEqual(4, len(self.registry.shards))
+
+    def test_histogram_exposition(self):
+        histogram = Histogram('test_seconds', 'Test histogram', buckets=[0.1, 1], registry=self.registry)
+        histogram.observe(0.05, view='a "b"')
+        histogram.observe(0.1, view='a "b"')
+        histogram.observe(2, view='a "b"')
+        self.assertEqual(
+            '# HELP test_seconds Test histogram\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{view="a \\"b\\"",le="0.1"} 2\n'
+            'test_seconds_bucket{view="a \\"b\\"",le="1"} 2\n'
+            'test_seconds_bucket{view="a \\"b\\"",le="+Inf"} 3\n'
+            'test_seconds_sum{view="a \\"b\\""} 2.15\n'
+            'test_seconds_count{view="a \\"b\\""} 3\n',
+            histogram.exposition())
+
+
+class QueryStatsTests(TestCase):
+    def test_book_lock_counted_as_lock_wait(self):
+        item = Item.objects.create(name='sword')
+        stats = QueryStats()
+        with connection.execute_wrapper(stats), transaction.atomic():
+            Item.lock_books([item.pk])
+        self.assertGreater(stats.lock_wait, 0)
+
+
+class MetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+
+    def test_requests_recorded_per_view(self):
+        requests = REQUESTS.value(view='api:item_listings', method='GET', status=200)
+        durations = REQUEST_DURATION.count(view='api:item_listings')
+        queries = REQUEST_DB_QUERIES.value(view='api:item_listings')
+        self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        self.assertEqual(requests + 1, REQUESTS.value(view='api:item_listings', method='GET', status=200))
+        self.assertEqual(durations + 1, REQUEST_DURATION.count(view='api:item_listings'))
+        self.assertLess(queries, REQUEST_DB_QUERIES.value(view='api:item_listings'))
+
+    async def test_async_requests_count_queries(self):
+        queries = REQUEST_DB_QUERIES.value(view='api:async_item_listings')
+        response = await self.async_client.get(reverse('api:async_item_listings', kwargs={'pk': 1}))
+        self.assertEqual(200, response.status_code)
+        self.assertLess(queries, REQUEST_DB_QUERIES.value(view='api:async_item_listings'))
+
+    async def test_concurrent_async_requests_count_own_queries(self):
+        url = reverse('api:async_item_detail', kwargs={'pk': self.item.pk})
+        queries = REQUEST_DB_QUERIES.value(view='api:async_item_detail')
+        await self.async_client.get(url)
+        per_request = REQUEST_DB_QUERIES.value(view='api:async_item_detail') - queries
+        responses = await asyncio.gather(*[self.async_client.get(url) for _ in range(10)])
+        self.assertEqual([200] * 10, [response.status_code for response in responses])
+        self.assertEqual(queries + 11 * per_request, REQUEST_DB_QUERIES.value(view='api:async_item_detail'))
+
+    def test_fills_counted_on_commit(self):
+        seller = User.objects.create_user(username='jon', password='abc')
+        for price in [10, 10, 12]:
+            Listing.objects.create(item=self.item, count=1, price=price, direction=Listing.Direction.SELL,
+                                   submitter=seller)
+        Wallet.get_users_wallet(self.user).add(100)
+        fills, levels = ORDER_FILLS.value(), ORDER_LEVELS_SWEPT.value()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.make_buy_transaction(self.user, count=3)
+        self.assertEqual((fills + 3, levels + 2), (ORDER_FILLS.value(), ORDER_LEVELS_SWEPT.value()))
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(200, response.status_code)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', response.content.decode())
+        self.assertIn('http_requests_total{method="GET",status="200",view="api:item_listings"}',
+                      response.content.decode())
@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from app.models import Item, Wallet
+from app.profiling import list_captures
+
+
+class TrafficRecorderMiddlewareTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.token = Token.objects.create(user=self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'traffic.jsonl')
+
+    def records(self):
+        with open(self.path) as traffic:
+            return [json.loads(line) for line in traffic]
+
+    def test_records_rest_requests(self):
+        Wallet.get_users_wallet(self.user)
+        with override_settings(TRAFFIC_RECORD_PATH=self.path):
+            self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), {'page_size': 5})
+            self.client.post(reverse('api:item_buy', kwargs={'pk': 1}), data={'count': 1},
+                             content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        listings, buy = self.records()
+        self.assertEqual(('GET', '/api/v1/item/1/listings?page_size=5', 200),
+                         (listings['method'], listings['path'], listings['status']))
+        self.assertEqual(('POST', f'Token {self.token.key}', 'application/json', {'count': 1}),
+                         (buy['method'], buy['authorization'], buy['content_type'], json.loads(buy['body'])))
+
+    async def test_records_async_requests(self):
+        with override_settings(TRAFFIC_RECORD_PATH=self.path):
+            await self.async_client.get(reverse('api:async_item_listings', kwargs={'pk': 1}))
+        record, = self.records()
+        self.assertEqual(('GET', '/api/v1/async/item/1/listings', 200),
+                         (record['method'], record['path'], record['status']))
+
+    def test_other_requests_not_recorded(self):
+        with override_settings(TRAFFIC_RECORD_PATH=self.path):
+            self.client.get(reverse('app:dashboard'))
+        self.assertFalse(os.path.exists(self.path))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.staff = User.objects.create_user(username='ben', password='abc', is_staff=True)
+        self.user = User.objects.create_user(username='jon', password='abc')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(PROFILE_DIR=directory.name, PROFILE_TOKEN='secret')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.directory = directory.name
+
+    def test_staff_request_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), HTTP_X_PROFILE='1')
+        name = response['X-Profile-Capture']
+        self.assertEqual({f'{name}.prof', f'{name}.sql', f'{name}.json'}, set(os.listdir(self.directory)))
+        capture, = list_captures()
+        self.assertEqual(('api:item_listings', 200), (capture['view'], capture['status']))
+        self.assertGreater(capture['queries'], 0)
+        with open(os.path.join(self.directory, f'{name}.sql')) as sql_log:
+            self.assertIn('FROM "app_item"', sql_log.read())
+
+    def test_token_request_profiled(self):
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), HTTP_X_PROFILE='secret')
+        self.assertIn('X-Profile-Capture', response)
+
+    async def test_async_request_profiled(self):
+        # The async client takes raw header names
+        response = await self.async_client.get(reverse('api:async_item_listings', kwargs={'pk': 1}),
+                                               **{'X-Profile': 'secret'})
+        name = response['X-Profile-Capture']
+        with open(os.path.join(self.directory, f'{name}.sql')) as sql_log:
+            self.assertIn('FROM "app_item"', sql_log.read())
+
+    def test_other_requests_not_profiled(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Capture', response)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        self.assertNotIn('X-Profile-Capture', response)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_admin_lists_captures(self):
+        self.client.force_login(self.staff)
+        name = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), HTTP_X_PROFILE='1')['X-Profile-Capture']
+        response = self.client.get(reverse('profile_captures'))
+        self.assertContains(response, name)
+        response = self.client.get(reverse('profile_capture_file', kwargs={'name': name, 'extension': 'sql'}))
+        self.assertEqual(200, response.status_code)
+        response = self.client.get(reverse('profile_capture_file', kwargs={'name': name, 'extension': 'py'}))
+        self.assertEqual(404, response.status_code)
+
+    def test_admin_requires_staff(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('profile_captures'))
+        self.assertEqual(302, response.status_code)
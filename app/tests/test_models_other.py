@@ -1,8 +1,14 @@
+from unittest import mock
+
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-from app.errors import CannotAffordError
-from app.models import Wallet, Item, InventoryItem
+from app.errors import CannotAffordError, FailedToCreateListingError, MissingWalletStripesError
+from app.metrics import LOCK_WAIT
+from app.models import Wallet, WalletStripe, Item, InventoryItem, Listing
 
 
 class WalletTests(TestCase):
@@ -35,6 +41,123 @@ class WalletTests(TestCase):
             wallet = Wallet.get_users_wallet(self.user)
             wallet.spend(10)
 
+    def test_add_from_stale_instance_keeps_concurrent_credit(self):
+        wallet = Wallet.get_users_wallet(self.user)
+        stale_wallet = Wallet.get_users_wallet(self.user)
+        wallet.add(6)
+        stale_wallet.add(4)
+        self.assertEqual(10, Wallet.get_users_wallet(self.user).coins)
+
+    def test_spend_from_stale_instance_cannot_overdraw(self):
+        Wallet.get_users_wallet(self.user).add(6)
+        wallet = Wallet.get_users_wallet(self.user)
+        stale_wallet = Wallet.get_users_wallet(self.user)
+        wallet.spend(5)
+        with self.assertRaises(CannotAffordError):
+            stale_wallet.spend(5)
+        self.assertEqual(1, Wallet.get_users_wallet(self.user).coins)
+
+    def test_add_to_users(self):
+        other_user = User.objects.create_user(username='tom', password='abc')
+        Wallet.get_users_wallet(self.user).add(6)
+        Wallet.add_to_users({self.user.pk: 4, other_user.pk: 3})
+        self.assertEqual(10, Wallet.get_users_wallet(self.user).coins)
+        self.assertEqual(3, Wallet.get_users_wallet(other_user).coins)
+
+
+class StripedWalletTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.wallet = Wallet.get_users_wallet(self.user)
+        self.wallet.add(10)
+        self.wallet.set_stripes(4)
+
+    def stripe_coins(self):
+        return list(WalletStripe.objects.filter(wallet=self.wallet).order_by('index').values_list('coins', flat=True))
+
+    def test_set_stripes_moves_coins(self):
+        self.assertEqual([10, 0, 0, 0], self.stripe_coins())
+        wallet = Wallet.get_users_wallet(self.user)
+        self.assertEqual(10, wallet.coins)
+        self.assertEqual(0, Wallet.objects.get(pk=wallet.pk).coins)
+
+        wallet.set_stripes(0)
+        self.assertEqual([], self.stripe_coins())
+        self.assertEqual(10, Wallet.objects.get(pk=wallet.pk).coins)
+
+    def test_add_and_add_to_users_credit_one_stripe(self):
+        Wallet.get_users_wallet(self.user).add(5)
+        other_user = User.objects.create_user(username='tom', password='abc')
+        Wallet.add_to_users({self.user.pk: 4, other_user.pk: 3})
+        self.assertEqual(19, sum(self.stripe_coins()))
+        self.assertLessEqual(sum(1 for coins in self.stripe_coins()[1:] if coins), 2)
+        self.assertEqual(19, Wallet.get_users_wallet(self.user).coins)
+        self.assertEqual(3, Wallet.get_users_wallet(other_user).coins)
+
+    def test_add_from_stale_instance_after_restriping(self):
+        stale_wallet = Wallet.get_users_wallet(self.user)
+        self.wallet.set_stripes(2)
+        # The stale instance still picks from four stripes
+        with mock.patch('app.models.random.randrange', side_effect=[3, 1]):
+            stale_wallet.add(5)
+        self.assertEqual([10, 5], self.stripe_coins())
+
+        stale_wallet = Wallet.get_users_wallet(self.user)
+        self.wallet.set_stripes(0)
+        stale_wallet.add(5)
+        self.assertEqual(20, Wallet.get_users_wallet(self.user).coins)
+
+    def test_spend_from_stale_instance_after_unstriping(self):
+        stale_wallet = Wallet.get_users_wallet(self.user)
+        self.wallet.set_stripes(0)
+        stale_wallet.spend(4)
+        self.assertEqual(6, Wallet.get_users_wallet(self.user).coins)
+        with self.assertRaises(CannotAffordError):
+            stale_wallet.spend(7)
+
+    def test_add_to_users_retries_credit_that_missed_its_stripe(self):
+        # A stripe removed between reading the striping and crediting it, as a concurrent set_stripes would
+        with mock.patch('app.models.random.randrange', side_effect=[7, 1]):
+            Wallet.add_to_users({self.user.pk: 4})
+        self.assertEqual([10, 4, 0, 0], self.stripe_coins())
+
+    def test_credits_to_missing_stripe_rows_give_up(self):
+        WalletStripe.objects.filter(wallet=self.wallet).delete()
+        with self.assertRaises(MissingWalletStripesError):
+            Wallet.get_users_wallet(self.user).add(5)
+        with self.assertRaises(MissingWalletStripesError):
+            Wallet.add_to_users({self.user.pk: 5})
+
+    def test_striping_read_only_in_admin(self):
+        self.client.force_login(User.objects.create_superuser(username='root', password='abc'))
+        response = self.client.post(reverse('admin:app_wallet_change', args=[self.wallet.pk]),
+                                    {'user': self.user.pk, 'coins': 0, 'stripes': 2})
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(4, Wallet.objects.get(pk=self.wallet.pk).stripes)
+        self.assertEqual(403, self.client.get(reverse('admin:app_walletstripe_add')).status_code)
+
+    def test_spend_draws_stripes_in_order(self):
+        WalletStripe.objects.filter(wallet=self.wallet).update(coins=5)
+        wallet = Wallet.get_users_wallet(self.user)
+        wallet.spend(12)
+        self.assertEqual(8, wallet.coins)
+        self.assertEqual([0, 0, 3, 5], self.stripe_coins())
+        with self.assertRaises(CannotAffordError):
+            wallet.spend(9)
+        self.assertEqual(8, Wallet.get_users_wallet(self.user).coins)
+
+    def test_fill_does_not_lock_striped_seller(self):
+        item = Item.objects.create(name='sword')
+        buyer = User.objects.create_user(username='tom', password='abc')
+        Wallet.get_users_wallet(buyer).add(30)
+        self.assertEqual([buyer.pk], [wallet.user_id for wallet in
+                                      Wallet.lock_for_settlement([buyer.pk], [self.user.pk])])
+
+        Listing.objects.create(item=item, count=3, price=10, direction=Listing.Direction.SELL, submitter=self.user)
+        item.make_buy_transaction(buyer, count=3)
+        self.assertEqual(40, Wallet.get_users_wallet(self.user).coins)
+        self.assertEqual(0, Wallet.get_users_wallet(buyer).coins)
+
 
 class ItemTests(TestCase):
     def test_add_to_user_inventory(self):
@@ -42,3 +165,72 @@ class ItemTests(TestCase):
         user = User.objects.create_user(username='ben', password='abc')
         item.add_to_user_inventory(user, count=20)
         self.assertEquals(20, InventoryItem.objects.get(user=user, item=item).count)
+        item.add_to_user_inventory(user, count=5)
+        self.assertEquals(25, InventoryItem.objects.get(user=user, item=item).count)
+
+    def test_add_many_upserts_in_one_statement(self):
+        sword, shield = Item.objects.create(name='sword'), Item.objects.create(name='shield')
+        ben = User.objects.create_user(username='ben', password='abc')
+        tom = User.objects.create_user(username='tom', password='abc')
+        InventoryItem.objects.create(user=ben, item=sword, count=3)
+
+        with CaptureQueriesContext(connection) as queries:
+            InventoryItem.add_many({(ben.pk, sword.pk): 2, (ben.pk, shield.pk): 4, (tom.pk, sword.pk): 1,
+                                    (tom.pk, shield.pk): 0})
+        self.assertEqual(1, len(queries))
+        self.assertEqual({(ben.pk, sword.pk): 5, (ben.pk, shield.pk): 4, (tom.pk, sword.pk): 1},
+                         {(user_id, item_id): count for user_id, item_id, count in
+                          InventoryItem.objects.values_list('user_id', 'item_id', 'count')})
+
+    def test_admin_grant_adds_to_existing_stack(self):
+        item = Item.objects.create(name='sword')
+        user = User.objects.create_user(username='ben', password='abc')
+        inventory_item = InventoryItem.objects.create(user=user, item=item, count=3)
+        admin_user = User.objects.create_superuser(username='root', password='abc')
+        self.client.force_login(admin_user)
+
+        response = self.client.post(reverse('admin:app_inventoryitem_add'),
+                                    {'user': user.pk, 'item': item.pk, 'count': 4})
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(7, InventoryItem.objects.get(pk=inventory_item.pk).count)
+        self.assertEqual(1, InventoryItem.objects.count())
+
+    def test_admin_grant_must_be_positive(self):
+        item = Item.objects.create(name='sword')
+        user = User.objects.create_user(username='ben', password='abc')
+        self.client.force_login(User.objects.create_superuser(username='root', password='abc'))
+
+        response = self.client.post(reverse('admin:app_inventoryitem_add'),
+                                    {'user': user.pk, 'item': item.pk, 'count': 0})
+        self.assertEqual(200, response.status_code)
+        self.assertFormError(response, 'adminform', 'count', 'Granted count must be positive')
+        self.assertFalse(InventoryItem.objects.exists())
+
+
+class BookLockTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+
+    def test_lock_wait_recorded(self):
+        books, wallets = LOCK_WAIT.count(lock='book'), LOCK_WAIT.count(lock='wallet')
+        Wallet.get_users_wallet(self.user).add(50)
+        self.item.make_buy_listing(self.user, count=5, price=10)
+        self.assertEqual((books + 1, wallets + 1), (LOCK_WAIT.count(lock='book'), LOCK_WAIT.count(lock='wallet')))
+
+    def test_book_locked_first(self):
+        Wallet.get_users_wallet(self.user).add(50)
+        with CaptureQueriesContext(connection) as queries:
+            self.item.make_buy_listing(self.user, count=5, price=10)
+        statements = [query['sql'] for query in queries if not query['sql'].startswith('SAVEPOINT')]
+        expected = 'SELECT pg_advisory_xact_lock' if connection.vendor == 'postgresql' else 'UPDATE "app_item"'
+        self.assertTrue(statements[0].startswith(expected), statements[0])
+
+    def test_sell_from_stale_inventory_item(self):
+        InventoryItem.objects.create(user=self.user, item=self.item, count=5)
+        inventory_item = InventoryItem.objects.get()
+        stale_inventory_item = InventoryItem.objects.get()
+        inventory_item.make_sell_listing(count=5, price=10)
+        with self.assertRaises(FailedToCreateListingError):
+            stale_inventory_item.make_sell_listing(count=5, price=10)
+        self.assertEqual(0, InventoryItem.objects.get().count)
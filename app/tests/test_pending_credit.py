@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from app.models import InventoryItem, Item, Listing, PendingCredit, Wallet
+
+
+@override_settings(DEFERRED_CREDITS=True)
+class DeferredCreditTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.buyer = User.objects.create_user(username='ben', password='abc')
+        self.seller = User.objects.create_user(username='jon', password='abc')
+        Wallet.get_users_wallet(self.buyer).add(100)
+        Wallet.get_users_wallet(self.seller).add(5)
+
+    def test_buy_journals_seller_credit(self):
+        Listing.objects.create(item=self.item, count=3, price=10, direction=Listing.Direction.SELL,
+                               submitter=self.seller)
+        Listing.objects.create(item=self.item, count=3, price=12, direction=Listing.Direction.SELL,
+                               submitter=self.seller)
+
+        result = self.item.make_buy_transaction(self.buyer, count=5)
+        self.assertEqual(54, result['coins_spent'])
+        self.assertEqual(46, Wallet.get_users_wallet(self.buyer).coins)
+        seller_wallet = Wallet.get_users_wallet(self.seller)
+        self.assertEqual(5, seller_wallet.coins)
+        self.assertEqual(59, seller_wallet.balance())
+        self.assertEqual([54], list(PendingCredit.objects.filter(user=self.seller).values_list('coins', flat=True)))
+
+    def test_seller_wallet_not_locked(self):
+        Listing.objects.create(item=self.item, count=3, price=10, direction=Listing.Direction.SELL,
+                               submitter=self.seller)
+        with CaptureQueriesContext(connection) as queries:
+            self.item.make_buy_listing(self.buyer, count=3, price=10)
+        wallet_writes = [query['sql'] for query in queries
+                         if 'app_wallet' in query['sql'] and not query['sql'].startswith('SELECT')]
+        self.assertEqual(1, len(wallet_writes))
+        self.assertEqual(30, PendingCredit.objects.get(user=self.seller).coins)
+
+    def test_sell_and_process_purchase_journal_credits(self):
+        Listing.objects.create(item=self.item, count=2, price=10, direction=Listing.Direction.BUY,
+                               submitter=self.buyer)
+        inventory_item = InventoryItem.objects.create(user=self.seller, item=self.item, count=2)
+        inventory_item.make_sell_transaction(2)
+        listing = Listing.objects.create(item=self.item, count=2, price=7, direction=Listing.Direction.SELL,
+                                         submitter=self.seller)
+        listing.process_purchase(1, self.buyer)
+        self.assertEqual(5, Wallet.get_users_wallet(self.seller).coins)
+        self.assertEqual(32, Wallet.get_users_wallet(self.seller).balance())
+
+    def test_flush(self):
+        PendingCredit.objects.create(user=self.seller, coins=10)
+        PendingCredit.objects.create(user=self.buyer, coins=3)
+        PendingCredit.objects.create(user=self.seller, coins=7)
+
+        self.assertEqual(2, PendingCredit.flush(batch_size=2))
+        self.assertEqual(15, Wallet.get_users_wallet(self.seller).coins)
+        self.assertEqual(103, Wallet.get_users_wallet(self.buyer).coins)
+        self.assertEqual(1, PendingCredit.flush(batch_size=2))
+        self.assertEqual(22, Wallet.get_users_wallet(self.seller).coins)
+        self.assertEqual(0, PendingCredit.flush(batch_size=2))
+        self.assertFalse(PendingCredit.objects.exists())
+
+    def test_dashboard_includes_pending_credits(self):
+        PendingCredit.objects.create(user=self.seller, coins=10)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.seller).key)
+        response = client.get(reverse('api:dashboard'))
+        self.assertEqual({'user': self.seller.pk, 'coins': 15}, response.json()['wallet'])
+
+
+class ImmediateCreditTests(TestCase):
+    def test_buy_credits_seller_wallet(self):
+        item = Item.objects.create(name='sword')
+        buyer = User.objects.create_user(username='ben', password='abc')
+        seller = User.objects.create_user(username='jon', password='abc')
+        Wallet.get_users_wallet(buyer).add(100)
+        Listing.objects.create(item=item, count=3, price=10, direction=Listing.Direction.SELL, submitter=seller)
+
+        item.make_buy_transaction(buyer, count=3)
+        self.assertEqual(30, Wallet.get_users_wallet(seller).coins)
+        self.assertFalse(PendingCredit.objects.exists())
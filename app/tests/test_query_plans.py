@@ -0,0 +1,80 @@
+import re
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+from django.utils import timezone
+
+from app.models import *
+
+FULL_SCAN_OR_SORT = {
+    'sqlite': re.compile(r'\bSCAN (TABLE )?\w+\b(?! USING)|USE TEMP B-TREE'),
+    'postgresql': re.compile(r'\b(Seq Scan|Sort|Incremental Sort)\b'),
+}
+
+
+@skipUnless(connection.vendor in FULL_SCAN_OR_SORT, 'Query plans are only checked on SQLite and PostgreSQL')
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        if connection.vendor == 'postgresql':
+            # Test tables are tiny, so make the planner prove it can use an index rather than prefer a scan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertIsNone(FULL_SCAN_OR_SORT[connection.vendor].search(plan), plan)
+
+    def test_sell_side(self):
+        self.assertUsesIndex(Listing.objects.sell_side(self.item))
+
+    def test_sell_side_page(self):
+        self.assertUsesIndex(Listing.objects.sell_side(self.item)[:20])
+
+    def test_buy_side(self):
+        self.assertUsesIndex(Listing.objects.buy_side(self.item))
+
+    def test_sell_side_keyset_page(self):
+        queryset = Listing.objects.sell_side(self.item)
+        self.assertUsesIndex(queryset.filter(Q(price__gt=10) | Q(price=10, pk__gt=1))[:21])
+
+    def test_buy_side_page(self):
+        self.assertUsesIndex(Listing.objects.buy_side(self.item)[:20])
+
+    def test_best_sell_price(self):
+        self.assertUsesIndex(Listing.objects.sell_side(self.item).values_list('price', flat=True)[:1])
+
+    def test_best_buy_price(self):
+        self.assertUsesIndex(Listing.objects.buy_side(self.item).values_list('price', flat=True)[:1])
+
+    def test_sell_levels(self):
+        self.assertUsesIndex(Listing.objects.sell_side(self.item).levels()[:10])
+
+    def test_buy_levels(self):
+        self.assertUsesIndex(Listing.objects.buy_side(self.item).levels()[:10])
+
+    def test_trades_in_time_range(self):
+        now = timezone.now()
+        self.assertUsesIndex(Trade.objects.filter(item=self.item, timestamp__gte=now - timedelta(hours=1),
+                                                  timestamp__lt=now).order_by('timestamp'))
+
+    def test_candles_in_time_range(self):
+        now = timezone.now()
+        self.assertUsesIndex(Candle.objects.filter(item=self.item, interval=Candle.Interval.MINUTE,
+                                                   start__gte=now - timedelta(hours=1),
+                                                   start__lt=now).order_by('-start')[:1000])
+
+    def test_dashboard_sell_listings(self):
+        self.assertUsesIndex(
+            Listing.objects.filter(submitter=self.user, direction=Listing.Direction.SELL).order_by('-pk'))
+
+    def test_dashboard_buy_listings(self):
+        self.assertUsesIndex(
+            Listing.objects.filter(submitter=self.user, direction=Listing.Direction.BUY).order_by('-pk'))
+
+    def test_dashboard_inventory(self):
+        self.assertUsesIndex(InventoryItem.objects.filter(user=self.user).order_by('pk'))
@@ -0,0 +1,81 @@
+import asyncio
+import tempfile
+
+from asgiref.sync import SyncToAsync
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from app.book_cache import BOOK_CACHE_ALIAS
+from app.models import *
+
+
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        caches[BOOK_CACHE_ALIAS].clear()
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.other_user = User.objects.create_user(username='jon', password='abc')
+        self.token = Token.objects.create(user=self.user)
+
+    def get(self, url, authenticated=True):
+        headers = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'} if authenticated else {}
+        return self.client.get(url, **headers)
+
+    def test_item_listings_matches_sync_view(self):
+        Listing.objects.create(submitter=self.user, item=self.item, count=5, price=20, direction=Listing.Direction.SELL)
+        Listing.objects.create(submitter=self.user, item=self.item, count=5, price=10, direction=Listing.Direction.BUY)
+        response = self.get(reverse('api:async_item_listings', kwargs={'pk': 1}), authenticated=False)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.get(reverse('api:item_listings', kwargs={'pk': 1})).json(), response.json())
+
+    def test_item_listings_not_found(self):
+        response = self.get(reverse('api:async_item_listings', kwargs={'pk': 2}))
+        self.assertEqual(404, response.status_code)
+
+    def test_dashboard(self):
+        Listing.objects.create(submitter=self.user, item=self.item, count=5, price=20, direction=Listing.Direction.SELL)
+        response = self.get(reverse('api:async_dashboard'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('ben', response.json()['user'])
+        self.assertEqual([20], [listing['price'] for listing in response.json()['sellListings']])
+
+    def test_dashboard_unauthorized(self):
+        self.assertEqual(401, self.get(reverse('api:async_dashboard'), authenticated=False).status_code)
+        response = self.client.get(reverse('api:async_dashboard'), HTTP_AUTHORIZATION='Token wrong')
+        self.assertEqual(401, response.status_code)
+
+    def test_items(self):
+        response = self.get(reverse('api:async_item_list'), authenticated=False)
+        self.assertEqual({'next': None, 'results': [{'id': 1, 'name': 'sword'}]}, response.json())
+        response = self.get(reverse('api:async_item_detail', kwargs={'pk': 1}), authenticated=False)
+        self.assertEqual({'id': 1, 'name': 'sword'}, response.json())
+
+    def test_items_invalid_cursor(self):
+        response = self.client.get(reverse('api:async_item_list'), {'cursor': 'abc'})
+        self.assertEqual(404, response.status_code)
+
+    def test_inventory_only_contains_own_items(self):
+        own = InventoryItem.objects.create(user=self.user, item=self.item, count=5)
+        foreign = InventoryItem.objects.create(user=self.other_user, item=self.item, count=3)
+        response = self.get(reverse('api:async_inventory_list'))
+        self.assertEqual([own.pk], [inventory_item['id'] for inventory_item in response.json()['results']])
+        response = self.get(reverse('api:async_inventory_detail', kwargs={'pk': own.pk}))
+        self.assertEqual(5, response.json()['count'])
+        response = self.get(reverse('api:async_inventory_detail', kwargs={'pk': foreign.pk}))
+        self.assertEqual(404, response.status_code)
+
+    def test_inventory_unauthorized(self):
+        self.assertEqual(401, self.get(reverse('api:async_inventory_list'), authenticated=False).status_code)
+
+
+class AsgiMiddlewareChainTests(TestCase):
+    def test_chain_stays_on_event_loop(self):
+        # Any sync-only middleware would make Django wrap the whole chain in SyncToAsync
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(TRAFFIC_RECORD_PATH=f'{directory}/traffic.jsonl', PROFILE_DIR=directory):
+            handler = ASGIHandler()
+        self.assertTrue(asyncio.iscoroutinefunction(handler._middleware_chain))
+        self.assertNotIsInstance(handler._middleware_chain, SyncToAsync)
@@ -1,8 +1,17 @@
+from datetime import datetime
+
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 
+from app.book_cache import BOOK_CACHE_ALIAS
 from app.models import *
+from app.rest.pagination import encode_cursor
+from app.rest.serializers import *
 
 
 class InventorySellViewTests(TestCase):
@@ -21,8 +30,18 @@ class InventorySellViewTests(TestCase):
         InventoryItem.objects.create(user=self.user, item=self.item, count=10)
         response = self.client.post(reverse('api:inventory_sell', kwargs={'pk': 1}), data={'count': 10, 'price': 5})
         self.assertEqual(200, response.status_code)
-        self.assertEqual(10, response.data['count'])
-        self.assertEqual(5, response.data['price'])
+        self.assertEqual(10, response.data['listing']['count'])
+        self.assertEqual(5, response.data['listing']['price'])
+
+    def test_make_crossing_listing(self):
+        buyer = User.objects.create_user(username='jon', password='abc')
+        InventoryItem.objects.create(user=self.user, item=self.item, count=10)
+        Listing.objects.create(submitter=buyer, item=self.item, count=10, price=8, direction=Listing.Direction.BUY)
+        response = self.client.post(reverse('api:inventory_sell', kwargs={'pk': 1}), data={'count': 10, 'price': 5})
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.data['listing'])
+        self.assertEqual(10, response.data['items_sold'])
+        self.assertEqual(80, response.data['coins_earned'])
 
     def test_user_does_not_have_items(self):
         InventoryItem.objects.create(user=self.user, item=self.item, count=10)
@@ -30,6 +49,229 @@ class InventorySellViewTests(TestCase):
         self.assertEqual(400, response.status_code)
 
 
+class InventoryMarketSellViewTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.buyer = User.objects.create_user(username='jon', password='abc')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_invalid_request(self):
+        InventoryItem.objects.create(user=self.user, item=self.item, count=10)
+        response = self.client.post(reverse('api:inventory_market_sell', kwargs={'pk': 1}), data={'abc': 10})
+        self.assertEqual(400, response.status_code)
+
+    def test_make_sale(self):
+        InventoryItem.objects.create(user=self.user, item=self.item, count=10)
+        Listing.objects.create(submitter=self.buyer, item=self.item, count=10, price=5, direction=Listing.Direction.BUY)
+        response = self.client.post(reverse('api:inventory_market_sell', kwargs={'pk': 1}), data={'count': 10})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(10, response.data['items_sold'])
+        self.assertEqual(50, response.data['coins_earned'])
+
+    def test_transaction_error(self):
+        InventoryItem.objects.create(user=self.user, item=self.item, count=10)
+        response = self.client.post(reverse('api:inventory_market_sell', kwargs={'pk': 1}), data={'count': 10})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('No listings', response.data['error'])
+
+    def test_other_users_inventory(self):
+        InventoryItem.objects.create(user=self.buyer, item=self.item, count=10)
+        response = self.client.post(reverse('api:inventory_market_sell', kwargs={'pk': 1}), data={'count': 10})
+        self.assertEqual(404, response.status_code)
+
+
+class DashboardViewTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            item = Item.objects.create(name=f'item-{Item.objects.count()}')
+            InventoryItem.objects.create(user=self.user, item=item, count=5)
+            Listing.objects.create(submitter=self.user, item=item, count=1, price=10, direction=Listing.Direction.SELL)
+            Listing.objects.create(submitter=self.user, item=item, count=1, price=5, direction=Listing.Direction.BUY)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_rows(1)
+        self.client.get(reverse('api:dashboard'))
+        with CaptureQueriesContext(connection) as one_row:
+            self.client.get(reverse('api:dashboard'))
+        self.add_rows(10)
+        with self.assertNumQueries(len(one_row)):
+            response = self.client.get(reverse('api:dashboard'))
+        self.assertEqual(11, len(response.data['inventory']))
+
+    def test_matches_serializers(self):
+        self.add_rows(2)
+        response = self.client.get(reverse('api:dashboard'))
+        listings = Listing.objects.filter(direction=Listing.Direction.SELL).order_by('-pk')
+        inventory_items = InventoryItem.objects.order_by('pk')
+        self.assertEqual(ListingSerializer(listings, many=True).data, response.data['sellListings'])
+        self.assertEqual(InventoryItemSerializer(inventory_items, many=True).data, response.data['inventory'])
+
+
+class ItemListingsViewTests(TestCase):
+    def setUp(self):
+        caches[BOOK_CACHE_ALIAS].clear()
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.client = APIClient()
+
+    def test_listings(self):
+        Listing.objects.create(submitter=self.user, item=self.item, count=5, price=20, direction=Listing.Direction.SELL)
+        Listing.objects.create(submitter=self.user, item=self.item, count=5, price=10, direction=Listing.Direction.BUY)
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([20], [listing['price'] for listing in response.data['sellListings']])
+        self.assertEqual([10], [listing['price'] for listing in response.data['buyListings']])
+
+    def test_unchanged_book_is_served_from_cache(self):
+        Listing.objects.create(submitter=self.user, item=self.item, count=5, price=20, direction=Listing.Direction.SELL)
+        first = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        with self.assertNumQueries(2):
+            second = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        self.assertEqual(first.data, second.data)
+
+    def test_write_invalidates_cache(self):
+        InventoryItem.objects.create(user=self.user, item=self.item, count=10)
+        self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        InventoryItem.objects.get().make_sell_listing(count=5, price=20)
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        self.assertEqual([20], [listing['price'] for listing in response.data['sellListings']])
+        Listing.objects.get().cancel()
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        self.assertEqual([], response.data['sellListings'])
+
+    def test_unchanged_book_not_modified(self):
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}),
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_changed_book_modified(self):
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}))
+        Item.bump_book_versions([self.item.pk])
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(200, response.status_code)
+
+    def test_listings_paginated_across_equal_prices(self):
+        for price in [10, 10, 10, 20, 30]:
+            Listing.objects.create(submitter=self.user, item=self.item, count=1, price=price,
+                                   direction=Listing.Direction.SELL)
+        pages = []
+        params = {'page_size': 2}
+        while True:
+            response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), params)
+            pages.append([listing['id'] for listing in response.data['sellListings']])
+            if response.data['sellListingsCursor'] is None:
+                break
+            params['sellListingsCursor'] = response.data['sellListingsCursor']
+        self.assertEqual([[1, 2], [3, 4], [5]], pages)
+
+    def test_next_page_unaffected_by_fill(self):
+        for price in [10, 20, 30, 40]:
+            Listing.objects.create(submitter=self.user, item=self.item, count=1, price=price,
+                                   direction=Listing.Direction.SELL)
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), {'page_size': 2})
+        Listing.objects.filter(price=10).delete()
+        Item.bump_book_versions([self.item.pk])
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}),
+                                   {'page_size': 2, 'sellListingsCursor': response.data['sellListingsCursor']})
+        self.assertEqual([30, 40], [listing['price'] for listing in response.data['sellListings']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}), {'sellListingsCursor': 'abc'})
+        self.assertEqual(404, response.status_code)
+
+    def test_cursor_with_invalid_values(self):
+        for values in [['x', 1], [None, 1], [10, 2 ** 64], [10, [1]]]:
+            response = self.client.get(reverse('api:item_listings', kwargs={'pk': 1}),
+                                       {'sellListingsCursor': encode_cursor(values)})
+            self.assertEqual(404, response.status_code, values)
+
+
+class ItemDepthViewTests(TestCase):
+    def setUp(self):
+        caches[BOOK_CACHE_ALIAS].clear()
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.client = APIClient()
+
+    def create_listing(self, count, price, direction):
+        Listing.objects.create(submitter=self.user, item=self.item, count=count, price=price, direction=direction)
+
+    def test_not_found(self):
+        response = self.client.get(reverse('api:item_depth', kwargs={'pk': 2}))
+        self.assertEqual(404, response.status_code)
+
+    def test_invalid_depth(self):
+        response = self.client.get(reverse('api:item_depth', kwargs={'pk': 1}), data={'depth': 0})
+        self.assertEqual(400, response.status_code)
+
+    def test_levels(self):
+        self.create_listing(5, 20, Listing.Direction.SELL)
+        self.create_listing(3, 20, Listing.Direction.SELL)
+        self.create_listing(1, 30, Listing.Direction.SELL)
+        self.create_listing(1, 40, Listing.Direction.SELL)
+        self.create_listing(2, 10, Listing.Direction.BUY)
+        self.create_listing(4, 15, Listing.Direction.BUY)
+        response = self.client.get(reverse('api:item_depth', kwargs={'pk': 1}), data={'depth': 2})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([
+            {'price': 20, 'total_count': 8, 'order_count': 2},
+            {'price': 30, 'total_count': 1, 'order_count': 1},
+        ], response.data['sellLevels'])
+        self.assertEqual([
+            {'price': 15, 'total_count': 4, 'order_count': 1},
+            {'price': 10, 'total_count': 2, 'order_count': 1},
+        ], response.data['buyLevels'])
+
+
+class ItemCandlesViewTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.client = APIClient()
+        Candle.add_trades([
+            Trade(item=self.item, price=10 + minute, count=2, timestamp=datetime(2020, 3, 1, 10, minute,
+                                                                                 tzinfo=timezone.utc))
+            for minute in range(10)
+        ])
+
+    def test_candles(self):
+        response = self.client.get(reverse('api:item_candles', kwargs={'pk': 1}), {'interval': '5m'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('5m', response.data['interval'])
+        self.assertEqual([(10, 14, 10, 14, 10), (15, 19, 15, 19, 10)],
+                         [(candle['open'], candle['high'], candle['low'], candle['close'], candle['volume'])
+                          for candle in response.data['candles']])
+        self.assertEqual(12, response.data['candles'][0]['vwap'])
+
+    def test_empty_volume(self):
+        Candle.objects.filter(interval=Candle.Interval.FIVE_MINUTES).update(volume=0, turnover=0)
+        response = self.client.get(reverse('api:item_candles', kwargs={'pk': 1}), {'interval': '5m'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([None, None], [candle['vwap'] for candle in response.data['candles']])
+
+    def test_time_range(self):
+        response = self.client.get(reverse('api:item_candles', kwargs={'pk': 1}),
+                                   {'start': '2020-03-01T10:02:30Z', 'end': '2020-03-01T10:05:00Z'})
+        self.assertEqual([12, 13, 14], [candle['open'] for candle in response.data['candles']])
+
+    def test_invalid_interval(self):
+        response = self.client.get(reverse('api:item_candles', kwargs={'pk': 1}), {'interval': '2m'})
+        self.assertEqual(400, response.status_code)
+
+    def test_missing_item(self):
+        response = self.client.get(reverse('api:item_candles', kwargs={'pk': 2}))
+        self.assertEqual(404, response.status_code)
+
+
 class ItemCreateBuyListingViewTests(TestCase):
     def setUp(self):
         self.item = Item.objects.create(name='sword')
@@ -46,8 +288,8 @@ class ItemCreateBuyListingViewTests(TestCase):
         self.wallet.add(50)
         response = self.client.post(reverse('api:item_create_buy_listing', kwargs={'pk': 1}), data={'count': 10, 'price': 5})
         self.assertEqual(200, response.status_code)
-        self.assertEqual(10, response.data['count'])
-        self.assertEqual(5, response.data['price'])
+        self.assertEqual(10, response.data['listing']['count'])
+        self.assertEqual(5, response.data['listing']['price'])
 
     def test_user_does_not_have_money(self):
         response = self.client.post(reverse('api:item_create_buy_listing', kwargs={'pk': 1}), data={'count': 20, 'price': 5})
@@ -66,6 +308,12 @@ class ItemBuyViewTests(TestCase):
         response = self.client.post(reverse('api:item_buy', kwargs={'pk': 1}), data={'abc': 10})
         self.assertEqual(400, response.status_code)
 
+    def test_negative_count(self):
+        Listing.objects.create(submitter=self.user, item=self.item, count=5, price=10, direction=Listing.Direction.SELL)
+        response = self.client.post(reverse('api:item_buy', kwargs={'pk': 1}), data={'count': -3})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(5, Listing.objects.get().count)
+
     def test_make_purchase(self):
         self.wallet.add(50)
         Listing.objects.create(submitter=self.user, item=self.item, count=10, price=5, direction=Listing.Direction.SELL)
@@ -78,3 +326,129 @@ class ItemBuyViewTests(TestCase):
         response = self.client.post(reverse('api:item_buy', kwargs={'pk': 1}), data={'count': 10})
         self.assertEqual(400, response.status_code)
         self.assertEqual('No listings', response.data['error'])
+
+
+class OrdersBatchViewTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.other_user = User.objects.create_user(username='jon', password='abc')
+        Wallet.get_users_wallet(self.user).add(1000)
+        InventoryItem.objects.create(user=self.user, item=self.item, count=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, operations):
+        return self.client.post(reverse('api:orders_batch'), data=operations, format='json')
+
+    def test_invalid_request(self):
+        response = self.post([{'op': 'create', 'side': 'buy', 'item': self.item.pk, 'count': 1}])
+        self.assertEqual(400, response.status_code)
+
+    def test_create(self):
+        response = self.post([
+            {'op': 'create', 'side': 'buy', 'item': self.item.pk, 'count': 5, 'price': 10},
+            {'op': 'create', 'side': 'sell', 'item': self.item.pk, 'count': 5, 'price': 20},
+            {'op': 'create', 'side': 'sell', 'item': self.item.pk, 'count': 50, 'price': 20},
+        ])
+        self.assertEqual(200, response.status_code)
+        results = response.data['results']
+        self.assertEqual(['ok', 'ok', 'error'], [result['status'] for result in results])
+        self.assertEqual(10, results[0]['listing']['price'])
+        self.assertEqual(20, results[1]['listing']['price'])
+        self.assertEqual('User does not have enough items', results[2]['error'])
+        self.assertEqual(2, Listing.objects.count())
+        self.assertEqual(950, Wallet.get_users_wallet(self.user).coins)
+
+    def test_cancel(self):
+        buy = Listing.objects.create(submitter=self.user, item=self.item, count=5, price=10,
+                                     direction=Listing.Direction.BUY)
+        sell = Listing.objects.create(submitter=self.user, item=self.item, count=5, price=20,
+                                      direction=Listing.Direction.SELL)
+        foreign = Listing.objects.create(submitter=self.other_user, item=self.item, count=5, price=30,
+                                         direction=Listing.Direction.SELL)
+        response = self.post([
+            {'op': 'cancel', 'listing': buy.pk},
+            {'op': 'cancel', 'listing': sell.pk},
+            {'op': 'cancel', 'listing': sell.pk},
+            {'op': 'cancel', 'listing': foreign.pk},
+        ])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['ok', 'ok', 'error', 'error'], [result['status'] for result in response.data['results']])
+        self.assertEqual([foreign], list(Listing.objects.all()))
+        self.assertEqual(1050, Wallet.get_users_wallet(self.user).coins)
+        self.assertEqual(15, InventoryItem.objects.get(user=self.user, item=self.item).count)
+
+    def test_amend(self):
+        listing = Listing.objects.create(submitter=self.user, item=self.item, count=5, price=10,
+                                         direction=Listing.Direction.BUY)
+        response = self.post([{'op': 'amend', 'listing': listing.pk, 'price': 12}])
+        self.assertEqual(200, response.status_code)
+        result = response.data['results'][0]
+        self.assertEqual('ok', result['status'])
+        self.assertEqual(5, result['listing']['count'])
+        self.assertEqual(12, result['listing']['price'])
+        self.assertFalse(Listing.objects.filter(pk=listing.pk).exists())
+        self.assertEqual(1000 + 50 - 60, Wallet.get_users_wallet(self.user).coins)
+
+    def test_failed_amend_keeps_listing(self):
+        listing = Listing.objects.create(submitter=self.user, item=self.item, count=5, price=10,
+                                         direction=Listing.Direction.BUY)
+        response = self.post([{'op': 'amend', 'listing': listing.pk, 'price': 1000}])
+        self.assertEqual('User does not have enough money', response.data['results'][0]['error'])
+        self.assertTrue(Listing.objects.filter(pk=listing.pk).exists())
+        self.assertEqual(1000, Wallet.get_users_wallet(self.user).coins)
+
+
+class ItemViewSetTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.client = APIClient()
+
+    def test_unchanged_catalogue_not_modified(self):
+        response = self.client.get(reverse('api:item-list'))
+        self.assertEqual(200, response.status_code)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api:item-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_catalogue_changes_modified(self):
+        etag = self.client.get(reverse('api:item-list'))['ETag']
+        Item.objects.create(name='shield')
+        response = self.client.get(reverse('api:item-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+        etag = response['ETag']
+        self.item.name = 'axe'
+        self.item.save()
+        response = self.client.get(reverse('api:item-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+    def test_trades_do_not_change_catalogue(self):
+        etag = self.client.get(reverse('api:item-list'))['ETag']
+        Item.bump_book_versions([self.item.pk])
+        response = self.client.get(reverse('api:item-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+    def test_unchanged_item_not_modified(self):
+        response = self.client.get(reverse('api:item-detail', kwargs={'pk': 1}))
+        self.assertEqual('sword', response.data['name'])
+        response = self.client.get(reverse('api:item-detail', kwargs={'pk': 1}), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_missing_item(self):
+        response = self.client.get(reverse('api:item-detail', kwargs={'pk': 2}))
+        self.assertEqual(404, response.status_code)
+
+    def test_catalogue_paginated(self):
+        for name in ['shield', 'axe']:
+            Item.objects.create(name=name)
+        response = self.client.get(reverse('api:item-list'), {'page_size': 2})
+        self.assertEqual(['sword', 'shield'], [item['name'] for item in response.data['results']])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(['axe'], [item['name'] for item in response.data['results']])
+        self.assertIsNone(response.data['next'])
+
+    def test_cursor_with_invalid_value(self):
+        response = self.client.get(reverse('api:item-list'), {'cursor': encode_cursor(['x'])})
+        self.assertEqual(404, response.status_code)
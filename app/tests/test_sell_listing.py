@@ -2,7 +2,7 @@ from django.contrib.auth.models import User
 from django.test import TestCase
 
 from app.errors import FailedToCreateListingError
-from app.models import Item, InventoryItem, Listing
+from app.models import Item, InventoryItem, Listing, Wallet
 
 
 class SellListingTests(TestCase):
@@ -17,17 +17,48 @@ class SellListingTests(TestCase):
             inventory_item.make_sell_listing(count=5, price=10)
         self.assertEqual(cm.exception.msg, 'User does not have enough items')
 
-    def test_buy_price_is_higher(self):
-        inventory_item = InventoryItem.objects.create(user=self.user, item=self.item, count=5)
-        Listing.objects.create(item=self.item, count=5, price=20, direction=Listing.Direction.BUY, submitter=self.user)
+    def test_crossing_listing_fills_at_resting_price(self):
+        buyer = User.objects.create_user(username='jon', password='abc')
+        other_buyer = User.objects.create_user(username='tom', password='abc')
+        inventory_item = InventoryItem.objects.create(user=self.user, item=self.item, count=10)
+        Listing.objects.create(item=self.item, count=2, price=20, direction=Listing.Direction.BUY, submitter=buyer)
+        Listing.objects.create(item=self.item, count=5, price=15, direction=Listing.Direction.BUY,
+                               submitter=other_buyer)
+        Listing.objects.create(item=self.item, count=5, price=5, direction=Listing.Direction.BUY, submitter=buyer)
 
-        with self.assertRaises(FailedToCreateListingError) as cm:
-            inventory_item.make_sell_listing(count=5, price=10)
-        self.assertEqual(cm.exception.msg, 'Cannot make listing when sell price is lower than highest buy listing')
+        result = inventory_item.make_sell_listing(count=5, price=10)
+        self.assertIsNone(result['listing'])
+        self.assertEqual(5, result['items_sold'])
+        self.assertEqual(40 + 45, result['coins_earned'])
+
+        inventory_item.refresh_from_db()
+        self.assertEqual(5, inventory_item.count)
+        self.assertEqual(85, Wallet.get_users_wallet(self.user).coins)
+        self.assertEqual(2, InventoryItem.objects.get(user=buyer, item=self.item).count)
+        self.assertEqual(3, InventoryItem.objects.get(user=other_buyer, item=self.item).count)
+        self.assertEqual([(15, 2), (5, 5)], list(Listing.objects.buy_side(self.item).values_list('price', 'count')))
+        self.assertFalse(Listing.objects.sell_side(self.item).exists())
+
+    def test_crossing_listing_rests_remainder(self):
+        buyer = User.objects.create_user(username='jon', password='abc')
+        inventory_item = InventoryItem.objects.create(user=self.user, item=self.item, count=10)
+        Listing.objects.create(item=self.item, count=2, price=20, direction=Listing.Direction.BUY, submitter=buyer)
+
+        result = inventory_item.make_sell_listing(count=5, price=10)
+        self.assertEqual(2, result['items_sold'])
+        self.assertEqual(40, result['coins_earned'])
+        self.assertEqual(3, result['listing'].count)
+        self.assertEqual(10, result['listing'].price)
+
+        inventory_item.refresh_from_db()
+        self.assertEqual(5, inventory_item.count)
+        self.assertEqual(2, InventoryItem.objects.get(user=buyer, item=self.item).count)
+        self.assertFalse(Listing.objects.buy_side(self.item).exists())
 
     def test_successful_listing(self):
         inventory_item = InventoryItem.objects.create(user=self.user, item=self.item, count=20)
-        inventory_item.make_sell_listing(count=5, price=10)
+        result = inventory_item.make_sell_listing(count=5, price=10)
+        self.assertEqual(0, result['items_sold'])
 
         listings = list(Listing.objects.all())
         self.assertEqual(1, len(listings))
@@ -0,0 +1,99 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from app.market_data import BookChanges
+from app.models import Item, Listing, Wallet, InventoryItem, Trade
+
+
+class TradeLedgerTests(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='sword')
+        self.user = User.objects.create_user(username='ben', password='abc')
+        self.seller = User.objects.create_user(username='jon', password='abc')
+
+    def sell(self, count, price):
+        return Listing.objects.create(item=self.item, count=count, price=price, direction=Listing.Direction.SELL,
+                                      submitter=self.seller)
+
+    def test_buy_transaction_records_trades(self):
+        self.sell(2, 10)
+        self.sell(5, 12)
+        Wallet.get_users_wallet(self.user).add(100)
+        self.item.make_buy_transaction(self.user, count=4)
+        trades = Trade.objects.order_by('sequence')
+        self.assertEqual([(1, 10, 2), (2, 12, 2)], [(trade.sequence, trade.price, trade.count) for trade in trades])
+        for trade in trades:
+            self.assertEqual(self.user, trade.buyer)
+            self.assertEqual(self.seller, trade.seller)
+            self.assertEqual(Listing.Direction.BUY, trade.taker_direction)
+        self.assertEqual(1, len({trade.timestamp for trade in trades}))
+
+    def test_sequence_continues_across_transactions(self):
+        self.sell(5, 10)
+        Wallet.get_users_wallet(self.user).add(100)
+        self.item.make_buy_transaction(self.user, count=1)
+        self.item.make_buy_transaction(self.user, count=1)
+        self.assertEqual([1, 2], list(Trade.objects.order_by('sequence').values_list('sequence', flat=True)))
+        self.item.refresh_from_db()
+        self.assertEqual(2, self.item.trade_sequence)
+
+    def test_sequences_are_per_item(self):
+        shield = Item.objects.create(name='shield')
+        self.sell(5, 10)
+        Listing.objects.create(item=shield, count=5, price=10, direction=Listing.Direction.SELL, submitter=self.seller)
+        Wallet.get_users_wallet(self.user).add(100)
+        self.item.make_buy_transaction(self.user, count=1)
+        shield.make_buy_transaction(self.user, count=1)
+        self.assertEqual([1, 1], list(Trade.objects.values_list('sequence', flat=True)))
+
+    def test_sell_into_buy_listing_records_seller_as_taker(self):
+        Wallet.get_users_wallet(self.user).add(50)
+        self.item.make_buy_listing(self.user, count=5, price=10)
+        inventory_item = InventoryItem.objects.create(user=self.seller, item=self.item, count=5)
+        inventory_item.make_sell_listing(count=3, price=8)
+        trade = Trade.objects.get()
+        self.assertEqual((self.user, self.seller), (trade.buyer, trade.seller))
+        self.assertEqual((10, 3), (trade.price, trade.count))
+        self.assertEqual(Listing.Direction.SELL, trade.taker_direction)
+
+    def test_empty_fill_records_no_trade(self):
+        changes = BookChanges()
+        changes.listing_filled(self.sell(5, 10), 0, self.user.pk)
+        changes.save()
+        self.assertFalse(Trade.objects.exists())
+
+    def test_resting_listing_records_no_trade(self):
+        Wallet.get_users_wallet(self.user).add(50)
+        self.item.make_buy_listing(self.user, count=5, price=10)
+        self.assertFalse(Trade.objects.exists())
+
+    def test_trades_outlive_users(self):
+        self.sell(5, 10)
+        Wallet.get_users_wallet(self.user).add(100)
+        self.item.make_buy_transaction(self.user, count=1)
+        self.user.delete()
+        trade = Trade.objects.get()
+        self.assertIsNone(trade.buyer)
+        self.assertEqual(self.seller, trade.seller)
+
+
+class TradeAdminTests(TestCase):
+    def test_ledger_read_only(self):
+        item = Item.objects.create(name='sword')
+        seller = User.objects.create_user(username='jon', password='abc')
+        Listing.objects.create(item=item, count=1, price=10, direction=Listing.Direction.SELL, submitter=seller)
+        buyer = User.objects.create_superuser(username='root', password='abc')
+        Wallet.get_users_wallet(buyer).add(10)
+        item.make_buy_transaction(buyer, 1)
+        trade = Trade.objects.get()
+        self.client.force_login(buyer)
+
+        self.assertEqual(200, self.client.get(reverse('admin:app_trade_changelist')).status_code)
+        self.assertEqual(200, self.client.get(reverse('admin:app_candle_changelist')).status_code)
+        self.assertEqual(403, self.client.get(reverse('admin:app_trade_add')).status_code)
+        response = self.client.post(reverse('admin:app_trade_change', args=[trade.pk]), {'price': 1})
+        self.assertEqual(403, response.status_code)
+        response = self.client.post(reverse('admin:app_trade_delete', args=[trade.pk]), {'post': 'yes'})
+        self.assertEqual(403, response.status_code)
+        self.assertEqual(10, Trade.objects.get().price)
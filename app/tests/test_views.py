@@ -1,6 +1,8 @@
+from django.core.cache import caches
 from django.test import TestCase
 from django.urls import reverse
 
+from app.book_cache import BOOK_CACHE_ALIAS
 from app.models import *
 
 
@@ -34,6 +36,7 @@ class DashboardViewTests(TestCase):
 
 class ItemBuyViewTests(TestCase):
     def setUp(self):
+        caches[BOOK_CACHE_ALIAS].clear()
         self.item = Item.objects.create(name='sword')
         self.user = User.objects.create_user(username='ben', password='abc')
 
@@ -72,3 +75,13 @@ class ItemBuyViewTests(TestCase):
         inventory_item = InventoryItem.objects.first()
         self.assertIsNotNone(inventory_item)
         self.assertEqual(20, inventory_item.count)
+
+    def test_listings_shown_after_purchase(self):
+        self.client.login(username='ben', password='abc')
+        Wallet.get_users_wallet(self.user).add(1000)
+        Listing.objects.create(submitter=self.user, item=self.item, count=20, price=50, direction=Listing.Direction.SELL)
+        response = self.client.get(reverse('app:item_buy', kwargs={'pk': 1}))
+        self.assertEqual(1, len(response.context['sell_listings']))
+        response = self.client.post(reverse('app:item_buy', kwargs={'pk': 1}),
+                                    data={'count': 20, 'buy': True})
+        self.assertEqual([], response.context['sell_listings'])
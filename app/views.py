@@ -2,6 +2,7 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import generic
 
+from app.book_cache import get_book_snapshot
 from app.errors import FailedToCreateListingError, FailedToMakeTransactionError
 from app.forms import CreateListingForm, BuyForm
 from app.models import Wallet, Item, Listing, InventoryItem
@@ -28,8 +29,6 @@ def dashboard(request):
 @login_required
 def item_buy(request, pk):
     item = get_object_or_404(Item, pk=pk)
-    sell_listings = Listing.objects.filter(item=item, direction=Listing.Direction.SELL).order_by('price')[:20]
-    buy_listings = Listing.objects.filter(item=item, direction=Listing.Direction.BUY).order_by('-price')[:20]
 
     buy_form = BuyForm()
     listing_form = CreateListingForm()
@@ -41,9 +40,12 @@ def item_buy(request, pk):
             listing_form = CreateListingForm(request.POST)
             if listing_form.is_valid():
                 try:
-                    item.make_buy_listing(request.user, count=listing_form.cleaned_data['count'],
-                                          price=listing_form.cleaned_data['price'])
-                    success_message = 'Listing created'
+                    result = item.make_buy_listing(request.user, count=listing_form.cleaned_data['count'],
+                                                   price=listing_form.cleaned_data['price'])
+                    success_message = 'Listing created' if result['listing'] else 'Listing filled'
+                    if result['items_purchased']:
+                        success_message += f', purchased {result["items_purchased"]} item(s) ' \
+                                           f'for {result["coins_spent"]} coins'
                 except FailedToCreateListingError as e:
                     error_message = e.msg
                     print(error_message)
@@ -55,11 +57,15 @@ def item_buy(request, pk):
                     success_message = f'Purchased {result["items_purchased"]} item(s) for {result["coins_spent"]} coins'
                 except FailedToMakeTransactionError as e:
                     error_message = e.msg
+        item.refresh_from_db(fields=['book_version'])
 
+    book = get_book_snapshot(item, 'top-20', lambda: {
+        'sell_listings': list(Listing.objects.sell_side(item).select_related('item')[:20]),
+        'buy_listings': list(Listing.objects.buy_side(item).select_related('item')[:20]),
+    })
     return render(request, 'app/item_buy.html', {
         'item': item,
-        'sell_listings': sell_listings,
-        'buy_listings': buy_listings,
+        **book,
         'buy_form': buy_form,
         'listing_form': listing_form,
         'error_message': error_message,
@@ -70,8 +76,6 @@ def item_buy(request, pk):
 @login_required
 def inventory_sell(request, pk):
     inventory_item = get_object_or_404(InventoryItem, pk=pk, user=request.user)
-    sell_listings = Listing.objects.filter(item=inventory_item.item, direction=Listing.Direction.SELL).order_by('price')
-    buy_listings = Listing.objects.filter(item=inventory_item.item, direction=Listing.Direction.BUY).order_by('-price')
     error_message = None
     if request.method == 'POST':
         form = CreateListingForm(request.POST)
@@ -84,11 +88,15 @@ def inventory_sell(request, pk):
                 error_message = e.msg
     else:
         form = CreateListingForm()
+    item = inventory_item.item
+    book = get_book_snapshot(item, 'all', lambda: {
+        'sell_listings': list(Listing.objects.sell_side(item).select_related('item')),
+        'buy_listings': list(Listing.objects.buy_side(item).select_related('item')),
+    })
     return render(request, 'app/inventory_sell.html', {
         'inventory_item': inventory_item,
-        'item': inventory_item.item,
-        'sell_listings': sell_listings,
-        'buy_listings': buy_listings,
+        'item': item,
+        **book,
         'form': form,
         'error_message': error_message
     })
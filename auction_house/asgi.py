@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'auction_house.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from app.routing import websocket_urlpatterns  # noqa: E402 (needs the app registry populated above)
+
+application = ProtocolTypeRouter({
+    'http': django_application,
+    'websocket': AllowedHostsOriginValidator(URLRouter(websocket_urlpatterns)),
+})
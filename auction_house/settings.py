@@ -41,22 +41,30 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
 
-    'debug_toolbar',
-
     'app'
 ]
 
 MIDDLEWARE = [
+    'app.middleware.MetricsMiddleware',
+    'app.middleware.TrafficRecorderMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
+# The toolbar's middleware is sync-only, with it in the stack Django runs every ASGI request in a worker thread and
+# the async views lose the event loop, so it has to be asked for
+DEBUG_TOOLBAR = DEBUG and bool(os.environ.get('DEBUG_TOOLBAR'))
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+    INTERNAL_IPS = [
+        '127.0.0.1',
+    ]
 
 ROOT_URLCONF = 'auction_house.urls'
 
@@ -78,6 +86,16 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'auction_house.wsgi.application'
 
+ASGI_APPLICATION = 'auction_house.asgi.application'
+
+# Market data streams. The in-memory layer only reaches clients connected to the same process, deployments running
+# several daphne processes need a shared layer such as channels_redis
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
@@ -98,6 +116,24 @@ else:
         'NAME': os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
     }
 
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Order book snapshots are keyed by book version, so they never expire and are only evicted (LRU) to make room
+    'order-books': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'order-books',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -140,12 +176,24 @@ STATIC_ROOT = '/static-files'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
-INTERNAL_IPS = [
-    '127.0.0.1',
-]
-
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
     ],
 }
+
+# REST traffic is appended to this JSONL file for manage.py replay_traffic when set
+TRAFFIC_RECORD_PATH = os.environ.get('TRAFFIC_RECORD_PATH')
+
+# Requests with an X-Profile header from a staff session, or carrying PROFILE_TOKEN in it, are profiled into this
+# directory when set
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+
+# The REST buy and sell endpoints queue orders for manage.py run_matcher instead of matching them in the request when
+# set. The HTML forms, listing cancels and batch orders still write the books in the request, under the book locks.
+ORDER_QUEUE = bool(os.environ.get('ORDER_QUEUE'))
+
+# Seller credits from fills are journaled and folded into the wallets by manage.py run_credit_flusher when set, the
+# credited coins show in balances right away but can only be spent once flushed
+DEFERRED_CREDITS = bool(os.environ.get('DEFERRED_CREDITS'))
@@ -17,9 +17,15 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken.views import obtain_auth_token
 
+from app.metrics import metrics_view
+from app.profiling import profile_capture_file, profile_captures
+
 from auction_house import settings
 
 urlpatterns = [
+    path('admin/profiles/', admin.site.admin_view(profile_captures), name='profile_captures'),
+    path('admin/profiles/<str:name>.<str:extension>', admin.site.admin_view(profile_capture_file),
+         name='profile_capture_file'),
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
 
@@ -27,10 +33,12 @@ urlpatterns = [
     path('api/v1/auth-token', obtain_auth_token, name='api_auth_token'),
     path('api/v1/', include('app.rest.urls')),
 
+    path('metrics', metrics_view, name='metrics'),
+
     path('', include('app.urls')),
 ]
 
-if settings.DEBUG:
+if settings.DEBUG_TOOLBAR:
     import debug_toolbar
     urlpatterns = [
         path('__debug__/', include(debug_toolbar.urls)),